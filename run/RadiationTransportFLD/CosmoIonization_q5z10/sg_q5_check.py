@@ -1,9 +1,12 @@
-# numpy/scipy-based error-checking script for Shapiro & Giroux q=0.5 test
+# numpy-based error-checking script for Shapiro & Giroux q=0.5 test
 # Daniel R. Reynolds, reynolds@smu.edu
 
 # imports
-from pylab import *
+import os, sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
 import numpy as np
+from fld_verify import dump_files, read_params, param, load_fields, rms, \
+     map_dumps, check_norm, ifront_solution
 
 
 # set the total number of snapshots
@@ -19,43 +22,19 @@ alpha2 = 2.52e-13      # recombination rate coefficient
 mp = 1.67262171e-24    # proton mass [g]
 Myr = 3.15576e13       # duration of a Megayear [sec]
 
-# initialize time-history outputs
-#    row 1: i-front radius
-#    row 2: stromgren sphere radius (rs)
-#    row 3: redshift (z)
-#    row 4: time (t)
-#    row 5: i-front radius (analytical)
-#    row 6: i-front velocity (analytical)
-rdata = zeros( (6, te+1), dtype=float);
-
 
 ##########
 # define some helpful functions
-def get_params(file):
+def get_cosmo_params(file):
     """Returns z0, z, xR, t0, H0, dUnit, tUnit, lUnit from a parameter files"""
-    import shlex
-    f = open(file)
-    for line in f:
-        text = shlex.split(line)
-        if ("CosmologyInitialRedshift" in text):
-            z0 = float(text[len(text)-1])
-        elif ("CosmologyCurrentRedshift" in text):
-            z = float(text[len(text)-1])
-        elif ("InitialTime" in text):
-            t0 = float(text[len(text)-1])
-        elif ("CosmologyHubbleConstantNow" in text):
-            H0 = float(text[len(text)-1])
-    f.close()
-    f = open(file + '.rtmodule' )
-    for line in f:
-        text = shlex.split(line)
-        if ("DensityUnits" in text):
-            dUnit = float(text[len(text)-1])
-        elif ("TimeUnits" in text):
-            tUnit = float(text[len(text)-1])
-        elif ("LengthUnits" in text):
-            lUnit = float(text[len(text)-1])
-    f.close()
+    params = read_params(file, '.rtmodule')
+    z0 = param(params, 'CosmologyInitialRedshift')
+    z = param(params, 'CosmologyCurrentRedshift')
+    t0 = param(params, 'InitialTime')
+    H0 = param(params, 'CosmologyHubbleConstantNow')
+    dUnit = param(params, 'DensityUnits')
+    tUnit = param(params, 'TimeUnits')
+    lUnit = param(params, 'LengthUnits')
     xR = lUnit
     t0 *= tUnit
     H0 *= 100*1e5/3.0857e24  # H0 units given 100km/s/Mpc, convert to 1/s 
@@ -63,16 +42,10 @@ def get_params(file):
 
 
 ##########
-def analytical_solution(q0,Nph,aval):
-    """Analytical solution driver, returns rI, vI"""
-    import h5py
-    import scipy.integrate as sp
-    z0, z, xR, t0, H0, dUnit, tUnit, lUnit = get_params('DD0000/data0000')
-    f = h5py.File('DD0000/data0000.cpu0000','r')
-    rho_data = f.get('/Grid00000001/Density')
-    rho = rho_data[0][0][0]*dUnit
-    del(rho_data)
-    mp = 1.67262171e-24
+def analytical_solution(q0,avals):
+    """Analytical solution driver, returns rI, vI for each expansion factor"""
+    z0, z, xR, t0, H0, dUnit, tUnit, lUnit = get_cosmo_params(dump_files(0)[0])
+    rho = load_fields(0, ['Density'])[0].flat[0]*dUnit
     # initial nH: no need to scale by a, since a(z0)=1, but we do
     # need to accomodate for Helium in analytical soln
 #    nH0 = rho/mp*0.76
@@ -84,134 +57,45 @@ def analytical_solution(q0,Nph,aval):
     #      cl = the gas clumping factor [1 -- homogeneous medium]
     #      n_{H,0} = initial Hydrogen number density
     #      t0 = initial time
-    alpha2 = 2.52e-13
     lamda = alpha2*nH0*t0
-    
-    # Compute the initial Stromgren radius, rs0 (proper, CGS units)
-    rs0 = (Nph*3.0/4.0/pi/alpha2/nH0/nH0)**(1.0/3.0)  # no rescaling since a(z0)=1
-    
-    # We have the general formula for y(t):
-    #    y(t) = (lamda/xi)exp(-tau(t)) integral_{1}^{a(t)} [da'
-    #            exp(t(a'))/sqrt(1-2q0 + 2q0(1+z0)/a')] ,  where
-    #    xi = H0*t0*(1+z0),
-    #    H0 = Hubble constant
-    #    tau(a) = (lamda/xi)*[F(a)-F(1)]/[3(2q0)^2(1+z0)^2/2],
-    #    F(a) = [2(1-2q0) - 2q0(1+z0)/a]*sqrt(1-2q0+2q0(1+z0)/a)
-    #
-    # Here, a' is the variable of integration, not the time-derivative of a.
-    F1 = (2.0*(1.0-2.0*q0) - 2.0*q0*(1.0+z0))*sqrt(1.0-2.0*q0+2.0*q0*(1.0+z0))
     xi = H0*t0*(1.0+z0)
-    
-    # set integration nodes/values (lots)
-    inodes = 1000001
-    if (aval == 1.0):
-        numint = 0.0
-    else:
-        a = linspace(1,aval,inodes)
-        integrand = zeros(inodes, dtype=float)
-        arat = divide(2.0*q0*(1.0+z0), a)
-        sqa = sqrt(add(1.0-2.0*q0, arat))
-        afac = subtract(2*(1-2*q0), arat)
-        arg1 = subtract(afac*sqa, F1)
-        arg2 = exp(multiply((lamda/xi)/(6*q0*q0*(1+z0)*(1+z0)), arg1))
-        integrand = divide(arg2,sqa)
-    
-        # perform numerical integral via composite Simpson's rule
-        numint = sp.simps(integrand, a)
-    tauval = (lamda/xi)*((2*(1-2*q0) - 2*q0*(1+z0)/aval)*sqrt(1-2*q0+2*q0*(1+z0)/aval)-F1)/(6*q0*q0*(1+z0)*(1+z0))
-    y = lamda/xi*exp(-tauval)*numint;
-    
-    # extract the current Stromgren radius and velocity
-    ythird = sign(y)*abs(y)**(1.0/3.0);
-    rI = ythird/aval    # compute ratio rI/rS
-    vI = (lamda/3)*aval/ythird*ythird*(1.0-y/aval**3);
-    return [rI, vI]
+    return ifront_solution(q0, z0, lamda, xi, avals)
 
 
 
 ##########
 def load_vals(tdump):
-    """Returns t, z, xR, nH, Eg, xHI, xHII from a given data dump"""
-    import h5py
-    import numpy as np
-    sdump = repr(tdump).zfill(4)
-    pfile = 'DD' + sdump + '/data' + sdump
-    hfile = pfile + '.cpu0000'
-    z0, z, xR, tval, H0, dUnit, tUnit, lUnit = get_params(pfile)
-    f = h5py.File(hfile,'r')
-    Eg = f.get('/Grid00000001/Grey_Radiation_Energy')
-    HI = f.get('/Grid00000001/HI_Density')
-    HII = f.get('/Grid00000001/HII_Density')
-    rho = f.get('/Grid00000001/Density')
+    """Returns t, z, nH and the computed i-front radius from a given data dump"""
+    z0, z, xR, tval, H0, dUnit, tUnit, lUnit = get_cosmo_params(dump_files(tdump)[0])
+    HII, rho = load_fields(tdump, ['HII_Density', 'Density'])
     # add floor values for happy numerics
-    HI  = np.add(HI,  1.0e-10)
-    HII = np.add(HII, 1.0e-10)
-    Eg  = np.add(Eg,  1.0e-30)
-    HIfrac = np.divide(HI,rho)
-    HIIfrac = np.divide(HII,rho)
-    Eg = np.multiply(Eg,dUnit*lUnit*lUnit/tUnit/tUnit)
-    nH = rho[0][0][0]*dUnit/1.67262171e-24
-    return [tval, z, xR, nH, Eg, HIfrac, HIIfrac]
+    HIIfrac = (HII + 1.0e-10)/rho
+    nH = rho.flat[0]*dUnit/1.67262171e-24
+
+    # compute I-front radius (assuming spherical)
+    dV = xR*xR*xR/rho.size
+    HIIvolume = np.sum(HIIfrac)*dV*8.0
+    rloc = (3.0/4.0*HIIvolume/np.pi)**(1.0/3.0)
+    return [tval, z, nH, rloc]
 
 ##########
 
 
 
 
-# loop over snapshots, loading values and times
-for tstep in range(te+1):
-    
-    # load relevant information
-    t, z, xR, nH, Eg, xHI, xHII = load_vals(tstep)
+# load times, redshifts, densities and i-front radii from all snapshots
+t, z, nH, rloc = np.array(map_dumps(load_vals, range(te+1))).T
 
-    # compute current Stromgren radius
-    rs = (Nph*3.0/4.0/pi/alpha2/nH/nH)**(1.0/3.0)
-    
-    # store initial hydrogen number density
-    if (tstep == 0):
-        ti = t
-        zi = z
-        nHi = nH
-        rsi = rs
+# compute current Stromgren radii
+rs = (Nph*3.0/4.0/np.pi/alpha2/nH/nH)**(1.0/3.0)
 
-    # compute volume element
-    nx, ny, nz = Eg.shape
-    dV = xR*xR*xR/nx/ny/nz
-    
-    # compute I-front radius (assuming spherical)
-    HIIvolume = sum(xHII)*dV*8.0
-    rloc = (3.0/4.0*HIIvolume/pi)**(1.0/3.0)
-    
-    # get analytical solutions for i-front position and velocity
-    a = (1.0+zi)/(1.0+z)        # paper's version of a
-    ranal, vanal = analytical_solution(q0,Nph,a)
-    
-    # store data
-    rdata[0][tstep] = rloc
-    rdata[1][tstep] = rs
-    rdata[2][tstep] = z
-    rdata[3][tstep] = t
-    rdata[4][tstep] = ranal
-    rdata[5][tstep] = vanal
-    
-
-
-# I-front radius/velocity plots vs analytical solutions
-#   scaled i-front position
-r_ratio = rdata[0]/rdata[1]
-ranal_ratio = rdata[4]
-
-#   i-front position comparison
-r_err = []
-for it in range(0, te+1):
-    r_err.append( (r_ratio[it]-ranal_ratio[it])/(ranal_ratio[it]+r_ratio[it]+0.1) )
+# get analytical solutions for i-front position
+a = (1.0+z[0])/(1.0+z)        # paper's version of a
+ranal_ratio = analytical_solution(q0,a)[0]
 
-# compute the error norm
-err_norm = (np.sum(np.multiply(r_err,r_err))/te)**(0.5)
-if (err_norm < tol):
-    print 'Error of ',err_norm,' is below tolerance ',tol
-    print 'PASS'
-else:
-    print 'Error of ',err_norm,' is above tolerance ',tol
-    print 'FAIL'
+# I-front position comparison vs analytical solution (scaled)
+r_ratio = rloc/rs
+r_err = (r_ratio-ranal_ratio)/(ranal_ratio+r_ratio+0.1)
 
+# compute the error norm
+check_norm(rms(r_err, te), tol)
@@ -1,9 +1,11 @@
-# matplotlib-based plotting script for Iliev et al. test #1
+# numpy-based error-checking script for Iliev et al. test #1
 # Daniel R. Reynolds, reynolds@smu.edu
 
 # imports
-from pylab import *
+import os, sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
 import numpy as np
+from fld_verify import rms, check_norm, ifront_history
 
 
 # set the total number of snapshots
@@ -19,97 +21,17 @@ mp = 1.67262171e-24    # proton mass [g]
 Myr = 3.15576e13       # duration of a Megayear [sec]
 nH = 1.0e-3            # input hydrogen number density [cm^(-3)]
 trec = 1.0/(aHII*nH)   # recombination time [sec]
-rs0 = (3.0*Ngammadot/4/pi/aHII/nH/nH)**(1.0/3.0)   # Stromgren radius
+rs0 = (3.0*Ngammadot/4/np.pi/aHII/nH/nH)**(1.0/3.0)   # Stromgren radius
 
-# initialize time-history outputs
-#    row 1: time (t)
-#    row 2: computed i-front radius
-#    row 3: predicted i-front radius (rI)
-#    row 4: stromgren sphere radius (rs)
-rdata = zeros( (4, te+1), dtype=float);
 
+# load times and i-front radii (from the ionized volume and from the
+# HI=0.5 crossing) from all snapshots
+t, radius, rfront = ifront_history(range(te+1))
 
-# define some helpful functions
-def get_params(file):
-    """Returns t, vol, dUnit, tUnit, lUnit from a given parameter file"""
-    import shlex
-    f = open(file)
-    for line in f:
-        text = shlex.split(line)
-        if ("InitialTime" in text):
-            tval = float(text[len(text)-1])
-        elif ("DensityUnits" in text):
-            dUnit = float(text[len(text)-1])
-        elif ("TimeUnits" in text):
-            tUnit = float(text[len(text)-1])
-        elif ("LengthUnits" in text):
-            lUnit = float(text[len(text)-1])
-        elif ("Gamma" in text):
-            gamma = float(text[len(text)-1])
-        elif ("DomainLeftEdge" in text):
-            xL = float(text[len(text)-3])
-            yL = float(text[len(text)-2])
-            zL = float(text[len(text)-1])
-        elif ("DomainRightEdge" in text):
-            xR = float(text[len(text)-3])
-            yR = float(text[len(text)-2])
-            zR = float(text[len(text)-1])
-    vol = (xR-xL)*(yR-yL)*(zR-zL)*lUnit*lUnit*lUnit
-    tval = tval*tUnit
-    return [tval, vol, dUnit, tUnit, lUnit]
-
-def load_vals(tdump):
-    """Returns t, vol, Eg, HIfrac, HIIfrac from a given data dump"""
-    import h5py
-    import numpy as np
-    sdump = repr(tdump).zfill(4)
-    pfile = 'DD' + sdump + '/data' + sdump
-    hfile = pfile + '.cpu0000'
-    tval, vol, dUnit, tUnit, lUnit = get_params(pfile)
-    f = h5py.File(hfile,'r')
-    Eg = f.get('/Grid00000001/Grey_Radiation_Energy')
-    HI = f.get('/Grid00000001/HI_Density')
-    HII = f.get('/Grid00000001/HII_Density')
-    rho = f.get('/Grid00000001/Density')
-    HIfrac = np.divide(HI,rho)
-    HIIfrac = np.divide(HII,rho)
-    Eg = np.add(Eg, 1.0e-30)
-    Eg = np.multiply(Eg,dUnit*lUnit*lUnit/tUnit/tUnit)
-    return [tval, vol, Eg, HIfrac, HIIfrac]
-
-
-
-# loop over snapshots, loading values and times
-for tstep in range(te+1):
-    
-    # load relevant information
-    t, vol, Eg, xHI, xHII = load_vals(tstep)
-    
-    # compute volume element
-    nx, ny, nz = Eg.shape
-    dV = vol/nx/ny/nz
-    
-    # compute I-front radius (assuming spherical)
-    HIIvolume = sum(xHII)*dV*8.0
-    radius = (3.0/4.0*HIIvolume/pi)**(1.0/3.0)
-    
-    # compute analytical solution
-    ranal = rs0*(1.0 - exp(-t/trec))**(1.0/3.0)
-    
-    # store data
-    rdata[0][tstep] = t/trec
-    rdata[1][tstep] = radius
-    rdata[2][tstep] = ranal
-    rdata[3][tstep] = rs0
-    
-
+# compute analytical solution
+ranal = rs0*(1.0 - np.exp(-t/trec))**(1.0/3.0)
 
 # I-front radius comparison (skip left-most point)
-r_err = (rdata[1][1:] - rdata[2][1:])/rs0
-r_err_norm = (np.sum(np.multiply(r_err,r_err))/te)**(0.5)
-if (r_err_norm < tol):
-    print 'Error of ',r_err_norm,' is below tolerance ',tol
-    print 'PASS'
-else:
-    print 'Error of ',r_err_norm,' is above tolerance ',tol
-    print 'FAIL'
+r_err = (radius[1:] - ranal[1:])/rs0
+print 'Error of the HI=0.5 I-front radius is ',rms((rfront[1:] - ranal[1:])/rs0, te)
+check_norm(rms(r_err, te), tol)
@@ -0,0 +1,481 @@
+# numpy-based routines shared by the RadiationTransportFLD error-checking
+# scripts
+#
+# The *_check.py scripts in each test directory put this directory on their
+# path and import what they need from here.  test_runner.py copies this file
+# next to the test directories, so the scripts work from a run directory as
+# well as from the source tree.
+
+# imports
+import os
+import functools
+import multiprocessing
+import multiprocessing.pool
+import threading
+import numpy as np
+
+
+def dump_files(tdump):
+    """Returns the parameter file and HDF5 file names of a given data dump"""
+    sdump = repr(tdump).zfill(4)
+    pfile = 'DD' + sdump + '/data' + sdump
+    return [pfile, pfile + '.cpu0000']
+
+def _typed(token):
+    """Converts one parameter value to an int or a float where it is one"""
+    for kind in (int, float):
+        try:
+            return kind(token)
+        except ValueError:
+            pass
+    return token
+
+_param_cache = {}
+
+def _read_param_file(file):
+    """Returns the parameters of one file, memoized by path and mtime"""
+    st = os.stat(file)
+    key = (os.path.abspath(file), st.st_mtime, st.st_size)
+    if key in _param_cache:
+        return _param_cache[key]
+    params = {}
+    f = open(file)
+    for line in f:
+        line = line.split('//')[0]
+        if ('=' not in line) or line.lstrip().startswith('#'):
+            continue
+        name, value = line.split('=', 1)
+        value = [_typed(token) for token in value.split()]
+        if len(value) == 1:
+            value = value[0]
+        params[name.strip()] = value
+    f.close()
+    _param_cache[key] = params
+    return params
+
+def read_params(file, *modules):
+    """Returns a dictionary of the values in an Enzo parameter file, merged
+    with those of its companion module files (file + suffix, e.g.
+    '.rtmodule'), which take precedence.  Values are ints, floats or strings,
+    or lists of them for parameters with several values.  Each file is only
+    parsed again if it changes."""
+    params = dict(_read_param_file(file))
+    for suffix in modules:
+        params.update(_read_param_file(file + suffix))
+    return params
+
+def param(params, name):
+    """Returns the (last) value of a parameter as a float"""
+    value = params[name]
+    if isinstance(value, list):
+        value = value[-1]
+    return float(value)
+
+_hierarchy_cache = {}
+
+def read_hierarchy(tdump):
+    """Returns [grids, top_dims] for a given data dump, where grids holds a
+    dictionary for each grid in its .hierarchy file, with its 'id', the
+    HDF5 'file' holding its data, its active 'dims' and 'left'/'right' edges
+    (x,y,z order), and the 'start' index of its first active cell on the
+    top grid if it is a top-level grid (None otherwise).  Memoized by path
+    and mtime like read_params."""
+    pfile = dump_files(tdump)[0]
+    hfile = pfile + '.hierarchy'
+    if not os.path.exists(hfile):
+        # a dump without a hierarchy holds a single grid
+        return [[dict(id=1, file=dump_files(tdump)[1], dims=None,
+                      left=None, right=None, start=0)], None]
+    st = os.stat(hfile)
+    key = (os.path.abspath(hfile), st.st_mtime, st.st_size)
+    if key in _hierarchy_cache:
+        return _hierarchy_cache[key]
+
+    params = read_params(pfile)
+    rank = int(params.get('TopGridRank', 3))
+    top_dims = np.array(params['TopGridDimensions'], dtype=int).ravel()[:rank]
+    domain_left = np.array(params['DomainLeftEdge'], dtype=float).ravel()[:rank]
+    domain_right = np.array(params['DomainRightEdge'], dtype=float).ravel()[:rank]
+    top_dx = (domain_right - domain_left)/top_dims
+
+    grids = []
+    grid = None
+    f = open(hfile)
+    for line in f:
+        if '=' not in line or line.startswith('Pointer'):
+            continue
+        name, value = [w.strip() for w in line.split('=', 1)]
+        if name == 'Grid':
+            grid = {'id': int(value)}
+            grids.append(grid)
+        elif grid is not None and name in ('GridRank', 'GridStartIndex',
+                                           'GridEndIndex', 'GridLeftEdge',
+                                           'GridRightEdge', 'BaryonFileName'):
+            grid[name] = value
+    f.close()
+
+    for grid in grids:
+        grank = int(grid['GridRank'])
+        gstart = np.array(grid['GridStartIndex'].split()[:grank], dtype=int)
+        gend = np.array(grid['GridEndIndex'].split()[:grank], dtype=int)
+        grid['dims'] = gend - gstart + 1
+        grid['left'] = np.array(grid['GridLeftEdge'].split()[:grank], dtype=float)
+        grid['right'] = np.array(grid['GridRightEdge'].split()[:grank], dtype=float)
+        # the data file is named relative to where Enzo ran
+        filename = grid['BaryonFileName']
+        if not os.path.exists(filename):
+            filename = os.path.join(os.path.dirname(hfile),
+                                    os.path.basename(filename))
+        grid['file'] = filename
+        dx = (grid['right'] - grid['left'])/grid['dims']
+        if np.allclose(dx, top_dx[:grank]):
+            grid['start'] = np.rint((grid['left'] - domain_left[:grank])/top_dx[:grank]).astype(int)
+        else:
+            grid['start'] = None
+        for name in ('GridRank', 'GridStartIndex', 'GridEndIndex',
+                     'GridLeftEdge', 'GridRightEdge', 'BaryonFileName'):
+            del grid[name]
+    grids = [grids, top_dims]
+    _hierarchy_cache[key] = grids
+    return grids
+
+def load_grids(tdump, fields, threads=None):
+    """Returns a list of (grid, vals) with the named fields of every grid
+    in a given data dump, where grid is its entry from read_hierarchy and
+    vals the list of arrays.  The HDF5 files are read by a pool of threads
+    (one per cpu file, up to the number of cores by default)."""
+    import h5py
+    grids = read_hierarchy(tdump)[0]
+    files = {}
+    for grid in grids:
+        files.setdefault(grid['file'], []).append(grid)
+
+    def read_file(filename):
+        f = h5py.File(filename, 'r')
+        try:
+            return [(grid, [f['/Grid%08d/%s' % (grid['id'], field)][...]
+                            for field in fields])
+                    for grid in files[filename]]
+        finally:
+            f.close()
+
+    if threads is None:
+        threads = multiprocessing.cpu_count()
+    threads = min(threads, len(files))
+    if threads > 1:
+        pool = multiprocessing.pool.ThreadPool(threads)
+        try:
+            results = pool.map(read_file, sorted(files))
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [read_file(filename) for filename in sorted(files)]
+    return sum(results, [])
+
+def _top_index(grid):
+    """Returns the index of a top-level grid's data in the assembled top
+    grid, whose arrays (like the HDF5 datasets) are in z,y,x order"""
+    return tuple(slice(i, i + n) for i, n in
+                 zip(grid['start'][::-1], grid['dims'][::-1]))
+
+def load_fields(tdump, fields, threads=None):
+    """Returns the named fields of a given data dump as numpy arrays at the
+    resolution of the top grid, assembled from every top-level grid in the
+    hierarchy (see load_grids for the per-grid data)"""
+    top_dims = read_hierarchy(tdump)[1]
+    grids = load_grids(tdump, fields, threads)
+    if top_dims is None:
+        return grids[0][1]
+    shape = tuple(top_dims[::-1])
+    vals = [np.zeros(shape, dtype=v.dtype) for v in grids[0][1]]
+    for grid, data in grids:
+        if grid['start'] is None:
+            continue
+        index = _top_index(grid)
+        for val, d in zip(vals, data):
+            val[index] = d
+    return vals
+
+def long_axis(shape):
+    """Returns the axis a radiation front travels along in a 1D, 2D or 3D
+    field: the one longer than all others combined, or the last one if
+    there is none"""
+    shape = tuple(shape)
+    size = int(np.prod(shape))
+    for axis, n in enumerate(shape):
+        if n*n > size:
+            return axis
+    return len(shape) - 1
+
+class SlabReduction(object):
+    """Accumulated sums, sums of squares and maximum magnitudes over all but
+    one axis of a dataset, each a 1D array along the remaining axis"""
+    def __init__(self, n, count):
+        self.sum = np.zeros(n)
+        self.sumsq = np.zeros(n)
+        self.absmax = np.zeros(n)
+        self.count = count
+
+    def mean(self):
+        return self.sum/self.count
+
+    def rms(self):
+        return np.sqrt(self.sumsq/self.count)
+
+    def l2(self):
+        return np.sqrt(self.sumsq)
+
+    def linf(self):
+        return self.absmax
+
+def reduce_field(tdump, field, axis=None, max_bytes=64*2**20, threads=1):
+    """Reduces a field of a given data dump over all axes but one (by
+    default the long_axis of the top grid), reading each top-level grid a
+    hyperslab at a time so that no more than about max_bytes of it are in
+    memory per thread.  With threads > 1 the slabs are reduced by a pool of
+    threads."""
+    import h5py
+    grids, top_dims = read_hierarchy(tdump)
+    grids = [grid for grid in grids if grid['start'] is not None]
+    if top_dims is None:
+        f = h5py.File(grids[0]['file'], 'r')
+        shape = f['/Grid%08d/%s' % (grids[0]['id'], field)].shape
+        f.close()
+    else:
+        shape = tuple(top_dims[::-1])
+    if axis is None:
+        axis = long_axis(shape)
+    others = tuple(i for i in range(len(shape)) if i != axis)
+    red = SlabReduction(shape[axis], int(np.prod([shape[i] for i in others])))
+
+    # split every grid into slabs along the axis
+    slabs = []
+    for grid in grids:
+        if grid['dims'] is None:
+            gshape, offset = shape, 0
+        else:
+            gshape, offset = grid['dims'][::-1], grid['start'][::-1][axis]
+        count = int(np.prod([gshape[i] for i in others]))
+        step = max(1, max_bytes//(count*8))
+        slabs += [(grid, offset, start, min(start + step, gshape[axis]))
+                  for start in range(0, gshape[axis], step)]
+    lock = threading.Lock()
+
+    def reduce_slab(slab_info):
+        grid, offset, start, stop = slab_info
+        index = [slice(None)]*len(shape)
+        index[axis] = slice(start, stop)
+        f = h5py.File(grid['file'], 'r')
+        try:
+            slab = np.asarray(f['/Grid%08d/%s' % (grid['id'], field)][tuple(index)],
+                              dtype=float)
+        finally:
+            f.close()
+        ssum = slab.sum(axis=others)
+        smax = np.abs(slab).max(axis=others)
+        slab *= slab
+        ssq = slab.sum(axis=others)
+        out = slice(offset + start, offset + stop)
+        # grids side by side add into the same part of the profile
+        lock.acquire()
+        try:
+            red.sum[out] += ssum
+            red.sumsq[out] += ssq
+            red.absmax[out] = np.maximum(red.absmax[out], smax)
+        finally:
+            lock.release()
+
+    threads = min(threads, len(slabs))
+    if threads > 1:
+        pool = multiprocessing.pool.ThreadPool(threads)
+        try:
+            pool.map(reduce_slab, slabs)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for slab_info in slabs:
+            reduce_slab(slab_info)
+    return red
+
+def rms(err, n=None):
+    """Returns (sum(err^2)/n)^(1/2), with n the number of entries by default"""
+    err = np.asarray(err, dtype=float)
+    if n is None:
+        n = err.size
+    return (np.dot(err.ravel(), err.ravel())/n)**(0.5)
+
+_reference_cache = {}
+
+def load_reference(filename):
+    """Returns the array stored in a reference solution (.npy) file, reading
+    each file only once unless it changes"""
+    key = (os.path.abspath(filename), os.path.getmtime(filename))
+    if key not in _reference_cache:
+        _reference_cache[key] = np.load(filename)
+    return _reference_cache[key]
+
+def interpolate(x_ref, y_ref, x):
+    """Returns y_ref(x_ref) linearly interpolated to all the points x at
+    once, extending the end segments to points outside of x_ref"""
+    x_ref = np.asarray(x_ref, dtype=float).ravel()
+    y_ref = np.asarray(y_ref, dtype=float).ravel()
+    x = np.asarray(x, dtype=float)
+    i = np.clip(np.searchsorted(x_ref, x, side='right') - 1, 0, x_ref.size - 2)
+    x0 = x_ref[i]
+    y0 = y_ref[i]
+    return y0 + (y_ref[i+1] - y0)*(x - x0)/(x_ref[i+1] - x0)
+
+def relative_errors(vals, ref, symmetric=False):
+    """Returns (vals-ref)/ref, or (vals-ref)/(vals+ref) if symmetric"""
+    vals = np.asarray(vals, dtype=float)
+    ref = np.asarray(ref, dtype=float)
+    if symmetric:
+        return (vals - ref)/(vals + ref)
+    return (vals - ref)/ref
+
+def error_norms(err, n=None):
+    """Returns the L2 (rms, see rms()) and Linf norms of an error array"""
+    return [rms(err, n), np.abs(err).max()]
+
+def print_errors(err, labels=None, name='snapshot'):
+    """Prints the error at each snapshot (or other labelled point)"""
+    err = np.asarray(err).ravel()
+    if labels is None:
+        labels = range(err.size)
+    for label, e in zip(labels, err):
+        print '  %s %s: error %.6e' % (name, label, e)
+
+def map_dumps(func, dumps, processes=None):
+    """Returns [func(tdump) for tdump in dumps], spreading the dumps over a
+    pool of processes (all available cores by default)"""
+    dumps = list(dumps)
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    processes = min(processes, len(dumps))
+    if processes <= 1:
+        return [func(tdump) for tdump in dumps]
+    pool = multiprocessing.Pool(processes)
+    try:
+        return pool.map(func, dumps)
+    finally:
+        pool.close()
+        pool.join()
+
+def ifront_radii(tdump, center=None, sphere_fraction=0.125):
+    """Returns [t, r_vol, r_front] for a given data dump: the time, the
+    radius of the sphere with the ionized volume (of which sphere_fraction
+    lies in the domain, an octant for a source in a corner), and the radius
+    at which the neutral fraction, averaged in radial bins one cell wide,
+    crosses 0.5.  All are in CGS units; center defaults to the domain's
+    left edge."""
+    params = read_params(dump_files(tdump)[0])
+    lUnit = param(params, 'LengthUnits')
+    tval = param(params, 'InitialTime')*param(params, 'TimeUnits')
+    xL = np.array(params['DomainLeftEdge'], dtype=float).ravel()
+    xR = np.array(params['DomainRightEdge'], dtype=float).ravel()
+    HII, rho = load_fields(tdump, ['HII_Density', 'Density'])
+    xHII = HII/rho
+
+    # radius of the ionized volume
+    vol = np.prod(xR-xL)*lUnit*lUnit*lUnit
+    HIIvolume = np.sum(xHII)*vol/xHII.size/sphere_fraction
+    r_vol = (3.0/4.0*HIIvolume/np.pi)**(1.0/3.0)
+
+    # cell-center radii, with the arrays in z,y,x order
+    if center is None:
+        center = xL
+    rank = xHII.ndim
+    n = xHII.shape[::-1]
+    dx = (xR[:rank] - xL[:rank])/n
+    r2 = np.zeros(xHII.shape)
+    for d in range(rank):
+        x = xL[d] + (np.arange(n[d]) + 0.5)*dx[d] - center[d]
+        shape = [1]*rank
+        shape[rank-1-d] = n[d]
+        r2 += (x*x).reshape(shape)
+    bins = (np.sqrt(r2)/dx.min()).astype(int).ravel()
+
+    # radially averaged neutral fraction and its 0.5 crossing
+    counts = np.bincount(bins)
+    filled = counts > 0
+    xHI = np.bincount(bins, weights=1.0-xHII.ravel())[filled]/counts[filled]
+    r = (np.arange(counts.size)[filled] + 0.5)*dx.min()
+    neutral = np.nonzero(xHI >= 0.5)[0]
+    if neutral.size == 0:
+        r_front = r[-1]
+    elif neutral[0] == 0:
+        r_front = 0.0
+    else:
+        k = neutral[0]
+        r_front = r[k-1] + (r[k]-r[k-1])*(0.5-xHI[k-1])/(xHI[k]-xHI[k-1])
+    return [tval, r_vol, r_front*lUnit]
+
+def ifront_history(dumps, center=None, sphere_fraction=0.125, processes=None):
+    """Returns the arrays t, r_vol and r_front (see ifront_radii) over all
+    of the given data dumps, which are analyzed by a pool of processes"""
+    radii = functools.partial(ifront_radii, center=center,
+                              sphere_fraction=sphere_fraction)
+    return np.array(map_dumps(radii, dumps, processes)).T
+
+def _simpson(f, a, b, m):
+    """Composite Simpson's rule for f over [a,b] with m (even) intervals"""
+    y = f(np.linspace(a, b, m+1))
+    return (b-a)/m/3.0*(y[0] + y[-1] + 4.0*y[1:-1:2].sum() + 2.0*y[2:-1:2].sum())
+
+_ifront_cache = {}
+
+def ifront_solution(q0, z0, lamda, xi, avals, inodes=1000001):
+    """Returns the Shapiro & Giroux I-front radius rI/rS and velocity vI at
+    each of the expansion factors in avals, where
+       lamda = chi_{eff} alpha2 cl n_{H,0} t0,
+       xi = H0*t0*(1+z0).
+    We have the general formula for y(t):
+       y(t) = (lamda/xi)exp(-tau(t)) integral_{1}^{a(t)} [da'
+               exp(t(a'))/sqrt(1-2q0 + 2q0(1+z0)/a')] ,  where
+       tau(a) = (lamda/xi)*[F(a)-F(1)]/[3(2q0)^2(1+z0)^2/2],
+       F(a) = [2(1-2q0) - 2q0(1+z0)/a]*sqrt(1-2q0+2q0(1+z0)/a)
+    The integral is accumulated with Simpson's rule between consecutive
+    expansion factors, using about inodes nodes in all, so every aval costs
+    one pass over [1, max(avals)].  Results are cached per parameter set."""
+    avals = np.asarray(avals, dtype=float)
+    key = (q0, z0, lamda, xi, tuple(avals), inodes)
+    if key in _ifront_cache:
+        return _ifront_cache[key]
+
+    def F(a):
+        return (2.0*(1.0-2.0*q0) - 2.0*q0*(1.0+z0)/a)*np.sqrt(1.0-2.0*q0+2.0*q0*(1.0+z0)/a)
+    F1 = F(1.0)
+    c = (lamda/xi)/(6.0*q0*q0*(1.0+z0)*(1.0+z0))
+
+    def integrand(a):
+        return np.exp(c*(F(a) - F1))/np.sqrt(1.0-2.0*q0 + 2.0*q0*(1.0+z0)/a)
+
+    # cumulative integral from the smallest node, with a=1 among the nodes
+    nodes = np.unique(np.append(avals, 1.0))
+    h = (nodes[-1] - nodes[0])/(inodes - 1)
+    cumint = np.zeros(nodes.size)
+    for i in range(1, nodes.size):
+        m = max(2, 2*int(np.ceil((nodes[i] - nodes[i-1])/h/2.0)))
+        cumint[i] = cumint[i-1] + _simpson(integrand, nodes[i-1], nodes[i], m)
+    numint = cumint[np.searchsorted(nodes, avals)] - cumint[np.searchsorted(nodes, 1.0)]
+
+    tauval = c*(F(avals) - F1)
+    y = lamda/xi*np.exp(-tauval)*numint
+
+    # extract the current Stromgren radius and velocity
+    ythird = np.sign(y)*abs(y)**(1.0/3.0)
+    rI = ythird/avals    # compute ratio rI/rS
+    vI = (lamda/3)*avals*(1.0-y/avals**3)
+    _ifront_cache[key] = [rI, vI]
+    return [rI, vI]
+
+def check_norm(err_norm, tol):
+    """Prints the standard PASS/FAIL statement for an error norm"""
+    if (err_norm < tol):
+        print 'Error of ',err_norm,' is below tolerance ',tol
+        print 'PASS'
+    else:
+        print 'Error of ',err_norm,' is above tolerance ',tol
+        print 'FAIL'
@@ -5,37 +5,25 @@
 #  Author: David Collins (dcollins4096@gmail.com), 2011-06-14 11:19 AM.  It's a bright sunny day here in Los Alamos.
 #
 
-import fnmatch
-import os
+from test_manifest import load_tests
 
 
-#Hunt for enzotest files.
+#Read enzotest files through the same cached index as test_runner.py.
 dbg = 0
 matches = []
-for root, dirnames, filenames in os.walk('.'):
-  for filename in fnmatch.filter(filenames, '*.enzotest'):
-      matches.append(os.path.join(root, filename))
 
 #Generate dictionary, make list of attributes
 tests={}
 attribute_list=['name','nprocs','max_time_minutes','dimensionality','runtime','critical','cadence','answer_testing_script','hydro','gravity','cooling','chemistry','cosmology','author','mhd','radiation','AMR']
-for file in matches:
+for file, variables in load_tests():
     if dbg > 0:
         print file
-    lines = open(file,'r').readlines()
+    matches.append(file)
     tests[file]={}
-    for line in lines:
-        if line.strip():
-            key, value = line.split("=")
-            if value[-1]=='\n':
-                value = value[:-1]
-            if value.count("#") > 0:
-                value = value[0:value.index("#")]
-            key=key.strip()
-            value=value.strip()
-            if key not in attribute_list:  
-                attribute_list.append(key)
-            tests[file][key]=value
+    for key, value in sorted(variables.items()):
+        if key not in attribute_list:  
+            attribute_list.append(key)
+        tests[file][key]=value
 
 #make csv
 csv = open('test_spreadsheet.csv','w')
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# A cached index of the *.enzotest files in the run directory.
+#
+# Each entry remembers the mtime and size of a test file along with the
+# variables it defines, so a file is only exec'd again when it changes.
+# Directory mtimes are stored as well; if none of them have changed, no
+# test file can have been added or removed and the walk is skipped.
+
+import os
+import os.path
+
+try:
+    import json
+except ImportError:
+    json = None
+
+known_categories = [
+    "Cooling",
+    "Cosmology",
+    "DrivenTurbulence3D",
+    "FLD",
+    "GravitySolver",
+    "Hydro",
+    "MHD",
+    "RadiationTransport",
+    "RadiationTransportFLD",
+]
+
+manifest_filename = 'enzotest_manifest.json'
+manifest_version = 1
+
+class TestManifest(object):
+    def __init__(self, filename = manifest_filename):
+        self.filename = filename
+        self.dirs = {}
+        self.entries = {}
+        self.dirty = False
+        self.parsed = 0
+        if json is None or filename is None or not os.path.exists(filename):
+            return
+        try:
+            f = open(filename, 'r')
+            data = json.load(f)
+            f.close()
+        except (IOError, ValueError):
+            print "Ignoring unreadable test manifest %s." % filename
+            return
+        if data.get('version') != manifest_version: return
+        self.dirs = data['dirs']
+        self.entries = data['entries']
+
+    def find_tests(self, categories = known_categories):
+        """Returns the sorted list of *.enzotest files in categories."""
+        files = self._cached_file_list(categories)
+        if files is not None: return files
+        files = []
+        self.dirs = {}
+        for cat in categories:
+            for dirname, dirnames, fns in os.walk(cat):
+                self.dirs[dirname] = os.stat(dirname).st_mtime
+                files += [os.path.join(dirname, fn) for
+                          fn in fns if fn.endswith(".enzotest")]
+        # Forget tests that have been removed.
+        for fn in self.entries.keys():
+            if fn not in files: del self.entries[fn]
+        self.dirty = True
+        return sorted(files)
+
+    def _cached_file_list(self, categories):
+        # The cache may have been built from a different set of categories.
+        for cat in categories:
+            if cat not in self.dirs: return None
+        for dirname, mtime in self.dirs.items():
+            try:
+                if os.stat(dirname).st_mtime != mtime: return None
+            except OSError:
+                return None
+        return sorted([fn for fn in self.entries
+                       if fn.split(os.sep)[0] in categories])
+
+    def variables(self, fn):
+        """Returns the variables defined in fn, exec'ing it only if it has
+        changed since it was last indexed."""
+        st = os.stat(fn)
+        entry = self.entries.get(fn)
+        if entry is not None and entry['mtime'] == st.st_mtime \
+                and entry['size'] == st.st_size:
+            return dict((str(k), _from_json(v))
+                        for k, v in entry['vars'].items())
+        # We now do something dangerous: we exec the file directly and grab
+        # its environment variables from it.
+        local_vars = {}
+        execfile(fn, {}, local_vars)
+        self.parsed += 1
+        self.entries[fn] = dict(mtime = st.st_mtime, size = st.st_size,
+                                vars = local_vars)
+        self.dirty = True
+        return local_vars
+
+    def save(self):
+        if json is None or self.filename is None or not self.dirty: return
+        data = dict(version = manifest_version, dirs = self.dirs,
+                    entries = self.entries)
+        # Write to a temporary file first so concurrent runners never see
+        # a half-written index.
+        tmp_filename = "%s.%d" % (self.filename, os.getpid())
+        try:
+            f = open(tmp_filename, 'w')
+            json.dump(data, f, indent=1, sort_keys=True)
+            f.close()
+            os.rename(tmp_filename, self.filename)
+        except (IOError, OSError, TypeError):
+            print "Could not write test manifest %s." % self.filename
+            if os.path.exists(tmp_filename): os.remove(tmp_filename)
+            return
+        self.dirty = False
+
+def _from_json(val):
+    if isinstance(val, unicode): return str(val)
+    return val
+
+def load_tests(filename = manifest_filename, categories = known_categories):
+    """Returns a list of (filename, variables) for every *.enzotest file,
+    refreshing and saving the manifest as needed."""
+    manifest = TestManifest(filename)
+    tests = [(fn, manifest.variables(fn))
+             for fn in manifest.find_tests(categories)]
+    manifest.save()
+    return tests
@@ -1,48 +1,67 @@
 #!/usr/bin/env python
 # This is the object that locates all *.enzo_test directories
 
+import errno
+import fcntl
+import fnmatch
+import glob
+import hashlib
+import heapq
 import imp
+import multiprocessing
 import optparse
 import os.path
+import re
+import select
 import shutil
 import signal
+import sqlite3
+import stat
+import struct
 import subprocess
 import sys
+import tarfile
+import threading
 import time
 import logging
 
-known_categories = [
-    "Cooling",
-    "Cosmology",
-    "DrivenTurbulence3D",
-    "FLD",
-    "GravitySolver",
-    "Hydro",
-    "MHD",
-    "RadiationTransport",
-    "RadiationTransportFLD",
-]
+from test_manifest import \
+    TestManifest, known_categories, manifest_filename
 
 try:
-    from yt.config import ytcfg
-    from yt.utilities.answer_testing.api import \
-        RegressionTestRunner, clear_registry, create_test, \
-        TestFieldStatistics, TestAllProjections
-    from yt.utilities.logger import ytLogger as mylog
-    from yt.utilities.logger import \
-        disable_stream_logging, ufstring
+    import json
+except ImportError:
+    json = None
+
+# yt and numpy take seconds to import, and are only needed to run answer
+# tests; see _load_answer_testing.
+RegressionTestRunner = None
+
+def _load_answer_testing():
+    """Imports yt's answer testing machinery into this module the first
+    time it is needed.  Returns False if yt does not support testing."""
+    global ytcfg, RegressionTestRunner, clear_registry, create_test, \
+        TestFieldStatistics, TestAllProjections, mylog, ufstring
+    if RegressionTestRunner is not None: return True
+    try:
+        from yt.config import ytcfg
+        from yt.utilities.answer_testing.api import \
+            RegressionTestRunner, clear_registry, create_test, \
+            TestFieldStatistics, TestAllProjections
+        from yt.utilities.logger import ytLogger as mylog
+        from yt.utilities.logger import \
+            disable_stream_logging, ufstring
+    except ImportError:
+        return False
     disable_stream_logging()
     ytcfg["yt","suppressStreamLogging"] = "True"
-except:
-    raise
-
-    RegressionTestRunner = None
 
-try:
-    import numpy
-    numpy.seterr(all = "ignore")
-except ImportError:
-    pass
+    try:
+        import numpy
+        numpy.seterr(all = "ignore")
+    except ImportError:
+        pass
+    return True
 
 # Test keyword types and default values.
 varspec = dict(
@@ -76,8 +95,15 @@ run_template_dir = 'run_templates'
 machines = {'local':       dict(script = 'local.run',
                                 command = 'bash'),
 
+            'local_batch': dict(script = 'local.run',
+                                command = 'bash',
+                                array_script = 'local_array.run',
+                                scheduler = 'fake'),
+
             'nics_kraken': dict(script = 'nics_kraken.run',
-                                command = 'qsub')}
+                                command = 'qsub',
+                                array_script = 'nics_kraken_array.run',
+                                scheduler = 'pbs')}
 
 # Map between job script variables and test keywords.
 template_vars = {'N_PROCS'   : 'nprocs',
@@ -87,6 +113,14 @@ template_vars = {'N_PROCS'   : 'nprocs',
 
 results_filename = 'test_results.txt'
 version_filename = 'version.txt'
+usage_filename = 'run_usage'
+history_filename = 'test_history.json'
+results_db_filename = 'test_results.db'
+benchmark_filename = 'benchmark.json'
+shard_filename = 'test_results.shard-%d-of-%d.json'
+divergence_filename = 'Diverged'
+# Answer test results with more elements are stored only as a summary.
+value_max_size = 1000
 
 # If we are able to, let's grab the ~/.enzo/machine_config.py file.
 try:
@@ -98,6 +132,8 @@ except ImportError:
 
 def _get_hg_version(path):
     print "Getting current revision."
+    version = _read_hg_dirstate(path)
+    if version is not None: return version
     from mercurial import hg, ui, commands 
     u = ui.ui() 
     u.pushbuffer() 
@@ -105,84 +141,1023 @@ def _get_hg_version(path):
     commands.identify(u, repo) 
     return u.popbuffer()
 
+def _read_hg_dirstate(path):
+    """Works out the 'hg identify' revision and modified flag from
+    .hg/dirstate without loading Mercurial, which takes seconds.  Tags are
+    not reported.  Returns None whenever a file's state can't be settled
+    from its mode, size and mtime alone, or the dirstate can't be parsed,
+    so that Mercurial can decide."""
+    try:
+        f = open(os.path.join(path, ".hg", "dirstate"), "rb")
+        data = f.read()
+        f.close()
+    except IOError:
+        return None
+    if len(data) < 40: return None
+    parent, merge = data[:20], data[20:40]
+    modified = merge != "\0" * 20
+    pos = 40
+    try:
+        while pos < len(data) and not modified:
+            state, mode, size, mtime, length = \
+                struct.unpack(">cllll", data[pos:pos + 17])
+            if length < 0 or pos + 17 + length > len(data):
+                raise ValueError("truncated dirstate entry")
+            fn = data[pos + 17:pos + 17 + length].split("\0")[0]
+            pos += 17 + length
+            if state != "n":
+                modified = True
+                break
+            try:
+                st = os.lstat(os.path.join(path, fn))
+            except OSError:
+                modified = True
+                break
+            # hg identify also counts a changed exec bit or a file turned
+            # into a symlink (or back) as a modification.
+            if stat.S_ISLNK(mode) != stat.S_ISLNK(st.st_mode) or \
+                    (mode & stat.S_IXUSR) != (st.st_mode & stat.S_IXUSR):
+                modified = True
+            elif size >= 0 and st.st_size != size:
+                modified = True
+            elif size < 0 or int(st.st_mtime) != mtime:
+                # Same size but touched since hg last looked: only a content
+                # comparison can tell.
+                return None
+    except (struct.error, ValueError):
+        # A damaged dirstate or a format this does not know.
+        return None
+    version = parent[:6].encode("hex")
+    if modified: version += "+"
+    try:
+        branch = open(os.path.join(path, ".hg", "branch")).read().strip()
+    except IOError:
+        branch = "default"
+    if branch != "default": version += " (%s)" % branch
+    return version + "\n"
+
 def _to_walltime(ts):
     return "%02d:%02d:%02d" % \
         ((ts / 3600), ((ts % 3600) / 60), 
          (ts % 60))
 
-def add_files(my_list, dirname, fns):
-    my_list += [os.path.join(dirname, fn) for
-                fn in fns if fn.endswith(".enzotest")]
+def _parse_duration(text):
+    """Converts a duration such as '90s', '30m' or '2h' to seconds.  A bare
+    number is taken to be minutes, like max_time_minutes."""
+    units = {'s': 1, 'm': 60, 'h': 3600}
+    text = text.strip()
+    scale = units.get(text[-1:].lower())
+    if scale is None:
+        scale = 60
+    else:
+        text = text[:-1]
+    return float(text) * scale
+
+def _parse_size(text):
+    """Converts a size such as '500M', '20G' or '1T' to bytes.  A bare
+    number is taken to be gigabytes."""
+    units = {'k': 1024, 'm': 1024**2, 'g': 1024**3, 't': 1024**4}
+    text = text.strip()
+    scale = units.get(text[-1:].lower())
+    if scale is None:
+        scale = units['g']
+    else:
+        text = text[:-1]
+    return int(float(text) * scale)
+
+def _disk_usage(path, seen=None):
+    """Bytes allocated under path, counting hard-linked files once."""
+    if seen is None: seen = set()
+    total = 0
+    if os.path.isfile(path):
+        walk = [(os.path.dirname(path), [], [os.path.basename(path)])]
+    else:
+        walk = os.walk(path)
+    for dirname, dirnames, fns in walk:
+        for fn in fns:
+            try:
+                st = os.lstat(os.path.join(dirname, fn))
+            except OSError:
+                continue
+            if (st.st_dev, st.st_ino) in seen: continue
+            seen.add((st.st_dev, st.st_ino))
+            total += st.st_blocks * 512
+    return total
+
+retention_modes = ['keep', 'compress', 'prune']
+
+def _test_value(test_data):
+    """How much we want a test in a time-limited suite."""
+    value = 1.0
+    if test_data['critical']: value += 2
+    if test_data['quicksuite']: value += 1
+    if test_data['pushsuite']: value += 1
+    return value
+
+def _expected_time(test_data, history):
+    if history is None: return 60 * test_data['max_time_minutes']
+    return history.expected_time(test_data)
+
+def _expected_memory(test_data, history):
+    if history is None: return None
+    return history.peak_memory(test_data)
+
+def _total_memory_kb():
+    """Physical memory of this node from /proc/meminfo, or None."""
+    try:
+        for line in open('/proc/meminfo'):
+            if line.startswith('MemTotal:'):
+                return int(line.split()[1])
+    except (IOError, ValueError):
+        pass
+    return None
+
+def _schedule_order(tests, history, key=lambda t: t):
+    """Longest expected run first (LPT), widest first among equals."""
+    return sorted(tests, key=lambda t: (-_expected_time(key(t), history),
+                                        -key(t)['nprocs']))
+
+def predict_makespan(tests, max_cores, history=None):
+    """Returns the expected wall time in seconds to run tests (a list of
+    test dicts) with the same packing as EnzoTestCollection.run_all_sims."""
+    pending = _schedule_order(tests, history)
+    running = []
+    now = 0.0
+    free_cores = max_cores
+    while pending or running:
+        for test_data in pending[:]:
+            nprocs = test_data['nprocs']
+            if nprocs > free_cores and \
+                    not (nprocs > max_cores and not running):
+                continue
+            pending.remove(test_data)
+            heapq.heappush(running,
+                           (now + _expected_time(test_data, history), nprocs))
+            free_cores -= nprocs
+        now, nprocs = heapq.heappop(running)
+        free_cores += nprocs
+    return now
+
+# Ways of putting the inputs of a test into its run directory.  Everything
+# but 'copy' shares the data of the original files.  Copies and reflinks,
+# which are copied on write, are the run's own and are made read-only so
+# that a run writing to its inputs fails; hardlinks and symlinks share the
+# original's inode and are left alone, which relies on simulations and
+# tests only creating new files in the run directory.
+stage_modes = ['copy', 'hardlink', 'reflink', 'symlink']
+
+# ioctl request to clone the extents of one file into another (Linux).
+_FICLONE = 0x40049409
+
+def _protect_staged(path):
+    """Removes the write bits from the staged files under path that are
+    private to it.  Links are skipped, since changing their mode would
+    change the original in the source tree."""
+    if os.path.isdir(path):
+        paths = [os.path.join(dirname, fn)
+                 for dirname, dirnames, fns in os.walk(path) for fn in fns]
+    else:
+        paths = [path]
+    for fn in paths:
+        if os.path.islink(fn): continue
+        st = os.stat(fn)
+        if st.st_nlink > 1: continue
+        os.chmod(fn, stat.S_IMODE(st.st_mode) &
+                 ~(stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH))
+
+def _stage_file(src, dst, mode):
+    """Puts src at dst according to mode, falling back to a copy if the
+    filesystem cannot link or clone it."""
+    if mode == 'symlink':
+        try:
+            os.symlink(os.path.abspath(src), dst)
+            return
+        except OSError:
+            pass
+    elif mode == 'hardlink':
+        try:
+            os.link(src, dst)
+            return
+        except OSError:
+            pass
+    elif mode == 'reflink':
+        fsrc = open(src, 'rb')
+        fdst = open(dst, 'wb')
+        try:
+            try:
+                fcntl.ioctl(fdst.fileno(), _FICLONE, fsrc.fileno())
+                cloned = True
+            except IOError:
+                cloned = False
+        finally:
+            fsrc.close()
+            fdst.close()
+        if cloned:
+            shutil.copystat(src, dst)
+            return
+    shutil.copy2(src, dst)
+
+def _stage_tree(src, dst, mode):
+    """Like shutil.copytree, but stages each file with _stage_file.  The
+    directories themselves are always created so outputs can be written."""
+    if mode == 'copy':
+        shutil.copytree(src, dst)
+        return
+    for dirname, dirnames, fns in os.walk(src):
+        dest_dir = os.path.join(dst, os.path.relpath(dirname, src))
+        os.makedirs(dest_dir)
+        for fn in fns:
+            _stage_file(os.path.join(dirname, fn), os.path.join(dest_dir, fn),
+                        mode)
+
+# Files in a test directory that do not affect the simulation, so changing
+# them should not invalidate its cached outputs.
+cache_ignore_patterns = ['*.enzotest', '*.py', '*.pyc', '*.pdf', '*.png',
+                         '*.txt', 'README', 'make_preconditions']
+
+_hash_memo = {}
+
+def _file_hash(path):
+    """Returns the sha1 of a file, remembered by path, size and mtime so the
+    executable is only read once per suite."""
+    st = os.stat(path)
+    memo_key = (os.path.abspath(path), st.st_size, st.st_mtime)
+    if memo_key not in _hash_memo:
+        h = hashlib.sha1()
+        f = open(path, 'rb')
+        while True:
+            block = f.read(1 << 20)
+            if not block: break
+            h.update(block)
+        f.close()
+        _hash_memo[memo_key] = h.hexdigest()
+    return _hash_memo[memo_key]
+
+class SimulationCache(object):
+    """Simulation outputs stored under the hash of everything that went into
+    them: the executable, the input files of the test and its nprocs.  An
+    identical run in any earlier revision can then be reused.  The timings
+    of the original run are not kept, so that a cache hit is never counted
+    as a run of the revision that fetched it."""
+    timing_files = [usage_filename, 'run_time']
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+
+    def key(self, my_test):
+        h = hashlib.sha1()
+        h.update("exe %s\n" % _file_hash(my_test.exe_path))
+        h.update("nprocs %d\n" % my_test.test_data['nprocs'])
+        for rel_path in sorted(self._inputs(my_test.test_data['fulldir'])):
+            h.update("%s %s\n" % (rel_path, _file_hash(
+                os.path.join(my_test.test_data['fulldir'], rel_path))))
+        return h.hexdigest()
+
+    def _inputs(self, test_dir):
+        inputs = []
+        for dirname, dirnames, fns in os.walk(test_dir):
+            for fn in fns:
+                if any([fnmatch.fnmatch(fn, pattern)
+                        for pattern in cache_ignore_patterns]): continue
+                inputs.append(os.path.relpath(os.path.join(dirname, fn),
+                                              test_dir))
+        return inputs
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def fetch(self, key, run_dir, mode):
+        """Stages the cached outputs for key into run_dir.  Returns False if
+        there are none."""
+        path = self._path(key)
+        if not os.path.isdir(path): return False
+        for dirname, dirnames, fns in os.walk(path):
+            dest_dir = os.path.join(run_dir, os.path.relpath(dirname, path))
+            if not os.path.isdir(dest_dir): os.makedirs(dest_dir)
+            for fn in fns:
+                dest = os.path.join(dest_dir, fn)
+                # Entries stored before timings were left out may have them.
+                if os.path.relpath(dest, run_dir) in self.timing_files:
+                    continue
+                if os.path.lexists(dest): os.remove(dest)
+                # Never let a run directory share data with the cache
+                # through symlinks; a hardlink is still safe.
+                _stage_file(os.path.join(dirname, fn), dest,
+                            mode == 'copy' and 'copy' or 'hardlink')
+        return True
+
+    def store(self, key, run_dir, inputs):
+        """Saves everything in run_dir that is not one of inputs."""
+        path = self._path(key)
+        if os.path.isdir(path): return
+        tmp_path = "%s.tmp.%d" % (path, os.getpid())
+        for dirname, dirnames, fns in os.walk(run_dir):
+            for fn in fns:
+                src = os.path.join(dirname, fn)
+                rel_path = os.path.relpath(src, run_dir)
+                if rel_path in inputs or rel_path in self.timing_files:
+                    continue
+                dest = os.path.join(tmp_path, rel_path)
+                if not os.path.isdir(os.path.dirname(dest)):
+                    os.makedirs(os.path.dirname(dest))
+                # The link shares the run's outputs with the cache as they
+                # are; their mode is left alone so the run can still
+                # rewrite them.
+                _stage_file(src, dest, 'hardlink')
+        if not os.path.isdir(tmp_path): return
+        # Renaming into place means a concurrent runner either sees the
+        # whole entry or none of it.
+        try:
+            os.rename(tmp_path, path)
+        except OSError:
+            shutil.rmtree(tmp_path)
+
+class ResultStore(object):
+    """An SQLite database of test outcomes for every revision run into an
+    output directory: per-test pass/fail counts, wall time and memory, and
+    the outcome and value of each individual answer test.  Unlike the text
+    summaries, it can be queried across many revisions at once."""
+
+    schema = """
+        CREATE TABLE IF NOT EXISTS revisions (
+            revision TEXT PRIMARY KEY, description TEXT, date REAL);
+        CREATE TABLE IF NOT EXISTS tests (
+            revision TEXT, test TEXT, name TEXT, finished INTEGER,
+            passed INTEGER, failed INTEGER, default_only INTEGER,
+            wall_time REAL, cpu_time REAL, peak_rss_kb INTEGER,
+            PRIMARY KEY (revision, test));
+        CREATE TABLE IF NOT EXISTS assertions (
+            revision TEXT, test TEXT, assertion TEXT, passed INTEGER,
+            value TEXT, PRIMARY KEY (revision, test, assertion));
+        """
+
+    def __init__(self, filename, revision = None, description = None):
+        self.filename = filename
+        self.revision = revision
+        self.conn = sqlite3.connect(filename)
+        self.conn.executescript(self.schema)
+        columns = [row[1] for row in
+                   self.conn.execute("PRAGMA table_info(assertions)")]
+        if 'value' not in columns:
+            self.conn.execute("ALTER TABLE assertions ADD COLUMN value TEXT")
+        if revision is not None:
+            self.conn.execute("INSERT OR REPLACE INTO revisions VALUES "
+                              "(?, ?, ?)", (revision, description, time.time()))
+            self.conn.commit()
+
+    def record(self, my_test, default_only):
+        test = my_test.test_data['fulldir']
+        usage = my_test.usage()
+        passed = len([r for r in my_test.results.values() if r])
+        failed = len(my_test.results) - passed
+        self.conn.execute("DELETE FROM assertions WHERE revision = ? AND "
+                          "test = ?", (self.revision, test))
+        self.conn.execute("INSERT OR REPLACE INTO tests VALUES "
+                          "(?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                          (self.revision, test, my_test.test_data['name'],
+                           int(my_test.run_finished), passed, failed,
+                           int(default_only), usage.get('wall_time'),
+                           usage.get('cpu_time'), usage.get('peak_rss_kb')))
+        self.conn.executemany("INSERT INTO assertions (revision, test, "
+                              "assertion, passed, value) VALUES "
+                              "(?, ?, ?, ?, ?)",
+                              [(self.revision, test, assertion, int(result),
+                                my_test.values.get(assertion))
+                               for assertion, result in
+                               my_test.results.items()])
+
+    def commit(self):
+        self.conn.commit()
+
+    def revisions(self, count = None):
+        """Returns up to count revisions, most recent first."""
+        sql = "SELECT revision FROM revisions ORDER BY date DESC"
+        if count is not None: sql += " LIMIT %d" % count
+        return [row[0] for row in self.conn.execute(sql)]
+
+    def test_outcomes(self, revisions):
+        """Returns {test: {revision: row}} for all tests in revisions in a
+        single query, where row has finished, passed, failed, wall_time and
+        peak_rss_kb."""
+        outcomes = {}
+        if not revisions: return outcomes
+        sql = "SELECT test, revision, finished, passed, failed, wall_time, " \
+              "peak_rss_kb FROM tests WHERE revision IN (%s)" % \
+              ", ".join(["?"] * len(revisions))
+        for row in self.conn.execute(sql, revisions):
+            outcomes.setdefault(row[0], {})[row[1]] = dict(
+                finished = row[2], passed = row[3], failed = row[4],
+                wall_time = row[5], peak_rss_kb = row[6])
+        return outcomes
+
+    def assertion_values(self, test, revisions):
+        """Returns {assertion: {revision: (passed, value)}} for one test over
+        revisions in a single query, with value the JSON-encoded result of
+        the answer test, or None if it was not recorded."""
+        values = {}
+        if not revisions: return values
+        sql = "SELECT assertion, revision, passed, value FROM assertions " \
+              "WHERE test = ? AND revision IN (%s)" % \
+              ", ".join(["?"] * len(revisions))
+        for row in self.conn.execute(sql, [test] + list(revisions)):
+            values.setdefault(row[0], {})[row[1]] = (row[2], row[3])
+        return values
+
+    def report(self, count):
+        """Prints a table of test outcomes over the last count revisions:
+        P for passed, F for failed, D for did not finish."""
+        revisions = self.revisions(count)
+        outcomes = self.test_outcomes(revisions)
+        print "%-70s%s" % ("", " ".join(["%-6s" % r[:6] for r in revisions]))
+        for test in sorted(outcomes):
+            flags = []
+            for revision in revisions:
+                row = outcomes[test].get(revision)
+                if row is None: flag = "."
+                elif not row['finished']: flag = "D"
+                elif row['failed']: flag = "F"
+                else: flag = "P"
+                flags.append("%-6s" % flag)
+            print "%-70s%s" % (test, " ".join(flags))
+
+    def close(self):
+        self.conn.close()
+
+def _read_lcaperf(run_dir):
+    """Returns {region: seconds} of exclusive wall time on the root processor,
+    summed over all the LCAPERF.### directories lcaperf wrote in run_dir."""
+    regions = {}
+    for lcaperf_dir in glob.glob(os.path.join(run_dir, "LCAPERF.*")):
+        for dirname, dirnames, fns in os.walk(lcaperf_dir):
+            for fn in fns:
+                _add_lcaperf_file(os.path.join(dirname, fn), regions)
+    return regions
+
+def _add_lcaperf_file(fn, regions):
+    # Each block is "global" lines, a header of "attribute name" and
+    # "<counter type> name" lines, then records of one line per attribute
+    # (the first being the region name) followed by one line per counter.
+    lines = [line.split() for line in open(fn) if line.strip()]
+    rank = None
+    attributes = 0
+    counters = []
+    i = 0
+    while i < len(lines):
+        words = lines[i]
+        if words[0] == 'global':
+            if words[1] == 'processor-rank': rank = int(words[2])
+            attributes = 0
+            counters = []
+            i += 1
+        elif len(words) == 2:
+            if words[0] == 'attribute': attributes += 1
+            else: counters.append(words[1])
+            i += 1
+        else:
+            record = lines[i:i + attributes + len(counters)]
+            i += len(record)
+            if rank != 0 or len(record) < attributes + len(counters): continue
+            values = dict(zip(counters, [int(w[0]) for w in record[attributes:]]))
+            region = record[0][0]
+            regions[region] = regions.get(region, 0.0) + \
+                values.get('time-real-excl', 0) * 1e-6
+
+def _mean_var(samples):
+    n = len(samples)
+    mean = sum(samples) / float(n)
+    if n < 2: return mean, 0.0
+    return mean, sum([(x - mean)**2 for x in samples]) / (n - 1)
+
+# One-sided 95% critical values of Student's t, by degrees of freedom.
+_t_critical = [(1, 6.314), (2, 2.920), (3, 2.353), (4, 2.132), (5, 2.015),
+               (6, 1.943), (7, 1.895), (8, 1.860), (9, 1.833), (10, 1.812),
+               (12, 1.782), (15, 1.753), (20, 1.725), (30, 1.697)]
+
+def is_slowdown(current, baseline, threshold):
+    """True if the samples in current are more than threshold (a fraction)
+    slower than those in baseline, and Welch's t-test says the difference
+    is significant at 95%.  With single samples only the threshold is used."""
+    mean_c, var_c = _mean_var(current)
+    mean_b, var_b = _mean_var(baseline)
+    if mean_c <= mean_b * (1.0 + threshold): return False
+    if len(current) < 2 or len(baseline) < 2: return True
+    se2 = var_c / len(current) + var_b / len(baseline)
+    if se2 == 0: return True
+    t = (mean_c - mean_b) / se2**0.5
+    df = se2**2 / ((var_c / len(current))**2 / (len(current) - 1) +
+                   (var_b / len(baseline))**2 / (len(baseline) - 1))
+    critical = _t_critical[0][1]
+    for table_df, table_t in _t_critical:
+        if df >= table_df: critical = table_t
+    if df > _t_critical[-1][0]: critical = 1.645
+    return t > critical
+
+class TestHistory(object):
+    """Wall times and peak memory of past simulations, kept across
+    revisions in a JSON file next to the per-revision output directories.
+    The runner orders tests by their wall time and keeps the peak memory of
+    the simulations it runs at once within the node's memory."""
+    max_samples = 10
+
+    def __init__(self, filename, revision = None):
+        self.filename = filename
+        self.revision = revision
+        self.new_samples = {}
+        self.tests = self._load()
+
+    def _load(self):
+        if json is None or self.filename is None or \
+                not os.path.exists(self.filename):
+            return {}
+        try:
+            f = open(self.filename, 'r')
+            tests = json.load(f)
+            f.close()
+        except (IOError, ValueError):
+            print "Ignoring unreadable test history %s." % self.filename
+            return {}
+        return tests
+
+    def record(self, my_test):
+        sample = dict(revision = self.revision, date = time.time(),
+                      wall_time = my_test.sim_usage['wall_time'],
+                      peak_rss_kb = my_test.sim_usage['peak_rss_kb'])
+        samples = self.tests.setdefault(my_test.test_data['fulldir'], [])
+        samples.append(sample)
+        del samples[:-self.max_samples]
+        self.new_samples.setdefault(my_test.test_data['fulldir'],
+                                    []).append(sample)
+
+    def has_timing(self, test_data):
+        return bool(self.tests.get(test_data['fulldir']))
+
+    def expected_time(self, test_data):
+        """Median of the recorded wall times, or the test's time limit if it
+        has never been run."""
+        samples = self.tests.get(test_data['fulldir'])
+        if not samples: return 60 * test_data['max_time_minutes']
+        times = sorted([s['wall_time'] for s in samples])
+        return times[len(times) / 2]
+
+    def peak_memory(self, test_data):
+        """Largest recorded peak memory in kB, or None if it is unknown."""
+        samples = self.tests.get(test_data['fulldir'], [])
+        memory = [s['peak_rss_kb'] for s in samples
+                  if s.get('peak_rss_kb') is not None]
+        if not memory: return None
+        return max(memory)
+
+    def save(self):
+        if json is None or self.filename is None: return
+        # Other runners, such as the other shards of a suite, may have saved
+        # since we loaded, so add our new samples to what is there now.
+        tests = self._load()
+        for test, samples in self.new_samples.items():
+            test_samples = tests.setdefault(test, [])
+            test_samples += samples
+            del test_samples[:-self.max_samples]
+        _save_json(self.filename, tests)
+        self.tests = tests
+        self.new_samples = {}
+
+class TestQuery(object):
+    """A boolean expression over the test keywords in varspec.
+
+    Terms compare a keyword to a value with ==, !=, <, <=, > or >= (a
+    single = also means equality), test membership with "in (a, b)", or
+    name a keyword on its own to mean that it is set (True, or not
+    None/empty).  Terms combine with and, or, not and parentheses.
+    Terms are evaluated against the collection's inverted indexes, so
+    each one costs a lookup rather than a pass over every test."""
+
+    _token_re = re.compile(r"\s*(?:(<=|>=|==|!=|<|>|=|\(|\)|,)|"
+                           r"('[^']*'|\"[^\"]*\")|([^\s<>=!(),]+))")
+
+    def __init__(self, expression):
+        self.expression = expression
+        self.tokens = []
+        pos = 0
+        expression = expression.rstrip()
+        while pos < len(expression):
+            m = self._token_re.match(expression, pos)
+            if m is None:
+                raise ValueError("Cannot parse query at: %s" % expression[pos:])
+            op, quoted, word = m.groups()
+            if op is not None: self.tokens.append(('op', op))
+            elif quoted is not None: self.tokens.append(('str', quoted[1:-1]))
+            else: self.tokens.append(('word', word))
+            pos = m.end()
+
+    def evaluate(self, collection):
+        """Returns the set of positions in collection.tests that match."""
+        self.collection = collection
+        self.all_ids = set(range(len(collection.tests)))
+        self.pos = 0
+        ids = self._or()
+        if self.pos != len(self.tokens):
+            raise ValueError("Unexpected '%s' in query: %s" %
+                             (self.tokens[self.pos][1], self.expression))
+        return ids
+
+    def _peek(self):
+        if self.pos < len(self.tokens): return self.tokens[self.pos]
+        return (None, None)
+
+    def _next(self):
+        token = self._peek()
+        if token[0] is None:
+            raise ValueError("Query ended unexpectedly: %s" % self.expression)
+        self.pos += 1
+        return token
+
+    def _expect(self, value):
+        kind, token = self._next()
+        if token != value:
+            raise ValueError("Expected '%s' but found '%s' in query: %s" %
+                             (value, token, self.expression))
+
+    def _or(self):
+        ids = self._and()
+        while self._peek() == ('word', 'or'):
+            self.pos += 1
+            ids = ids | self._and()
+        return ids
+
+    def _and(self):
+        ids = self._not()
+        while self._peek() == ('word', 'and'):
+            self.pos += 1
+            ids = ids & self._not()
+        return ids
+
+    def _not(self):
+        if self._peek() == ('word', 'not'):
+            self.pos += 1
+            return self.all_ids - self._not()
+        return self._term()
+
+    def _term(self):
+        kind, token = self._next()
+        if token == '(' and kind == 'op':
+            ids = self._or()
+            self._expect(')')
+            return ids
+        if kind != 'word' or token not in known_variables:
+            raise ValueError("Unknown test keyword '%s' in query: %s" %
+                             (token, self.expression))
+        param = token
+        index = self.collection.index(param)
+        kind, op = self._peek()
+        if (kind, op) == ('word', 'in'):
+            self.pos += 1
+            self._expect('(')
+            ids = set()
+            while True:
+                ids |= index.get(self._value(param), set())
+                kind, token = self._next()
+                if token == ')': break
+                if token != ',':
+                    raise ValueError("Expected ',' or ')' in query: %s" %
+                                     self.expression)
+            return ids
+        if kind != 'op' or op not in ('=', '==', '!=', '<', '<=', '>', '>='):
+            # A bare keyword means it is switched on.
+            ids = set()
+            for value, value_ids in index.items():
+                if value and value not in ("None", "False", "Key Missing"):
+                    ids |= value_ids
+            return ids
+        self.pos += 1
+        value = self._value(param)
+        if op in ('=', '=='):
+            return set(index.get(value, set()))
+        if op == '!=':
+            return self.all_ids - index.get(value, set())
+        compare = {'<':  lambda a: a < value,  '<=': lambda a: a <= value,
+                   '>':  lambda a: a > value,  '>=': lambda a: a >= value}[op]
+        # Range terms walk the distinct values of the keyword, not the tests.
+        ids = set()
+        for key in sorted(index.keys()):
+            if key is None or key == "Key Missing": continue
+            if compare(key): ids |= index[key]
+        return ids
+
+    def _value(self, param):
+        kind, token = self._next()
+        if kind == 'op':
+            raise ValueError("Expected a value for %s in query: %s" %
+                             (param, self.expression))
+        if kind == 'word' and token == 'None': return None
+        caster = known_variables[param]
+        if caster is bool:
+            if token not in ("True", "False"):
+                raise ValueError("%s must be True or False in query: %s" %
+                                 (param, self.expression))
+            return token == "True"
+        try:
+            return caster(token)
+        except ValueError:
+            raise ValueError("Bad value '%s' for %s in query: %s" %
+                             (token, param, self.expression))
+
+class EventStream(object):
+    """Writes one JSON object per line to filename as things happen, for
+    dashboards following a suite.  Every event has 'event' and 'time'
+    fields, and 'test' (the test's fulldir) if it concerns one test."""
+    def __init__(self, filename):
+        if json is None:
+            raise RuntimeError("Writing events needs the json module "
+                               "(Python 2.6 or later).")
+        self.f = open(filename, 'a')
+        self.lock = threading.Lock()
+
+    def emit(self, event, test=None, **fields):
+        fields['event'] = event
+        fields['time'] = time.time()
+        if test is not None: fields['test'] = test
+        line = json.dumps(fields, sort_keys=True)
+        # Answer test results arrive on the worker pool's result thread.
+        self.lock.acquire()
+        try:
+            self.f.write(line + "\n")
+            self.f.flush()
+        finally:
+            self.lock.release()
+
+    def close(self):
+        self.f.close()
 
 class EnzoTestCollection(object):
-    def __init__(self, tests = None, verbose=True):
+    def __init__(self, tests = None, verbose=True,
+                 manifest = manifest_filename):
         self.verbose = verbose
         if tests is None:
-            # Now we look for all our *.enzotest files
-            fns = []
-            for cat in known_categories:
-                os.path.walk(cat, add_files, fns)
+            # Now we look for all our *.enzotest files, using the manifest
+            # to avoid re-reading any that have not changed.
+            self.manifest = TestManifest(manifest)
             self.tests = []
-            for fn in sorted(fns):
+            for fn in self.manifest.find_tests(known_categories):
                 if self.verbose: print "HANDLING", fn
                 self.add_test(fn)
+            self.manifest.save()
+            if self.verbose:
+                print "Parsed %d of %d test files." % \
+                    (self.manifest.parsed, len(self.tests))
         else:
             self.tests = tests
         self.test_container = []
+        self.history = None
+        self.results_db = None
+        self.events = None
+        self.shard = None
+        self._indexes = {}
 
     def go(self, output_dir, interleaved, machine, exe_path, compare_dir,
-           sim_only=False, test_only=False):
+           sim_only=False, test_only=False, max_cores=1, pipeline=False,
+           history=None, results_db=None, test_workers=1, retention='keep',
+           quota=None, events=None):
         go_start_time = time.time()
         self.output_dir = output_dir
+        self.history = history
+        self.results_db = results_db
+        self.events = events
         total_tests = len(self.tests)
+        if self.shard is not None: self._clear_stale_shards()
+        if events is not None:
+            events.emit('suite_started', output_dir = output_dir,
+                        machine = machine, tests = total_tests,
+                        max_cores = max_cores)
         if interleaved:
             for i, my_test in enumerate(self.tests):
                 print "Preparing test: %s." % my_test['name']
-                self.test_container.append(EnzoTestRun(output_dir, my_test, 
-                                                       machine, exe_path))
+                self._prepare_test(output_dir, my_test, machine, exe_path)
                 if not test_only:
                     print "Running simulation: %d of %d." % (i, total_tests)
                     self.test_container[i].run_sim()
+                    if history is not None and \
+                            self.test_container[i].sim_finished:
+                        history.record(self.test_container[i])
+                        history.save()
                 if not sim_only:
                     print "Running test: %d of %d." % (i, total_tests)
                     self.test_container[-1].run_test(compare_dir)
+        elif pipeline and not (sim_only or test_only):
+            self.prepare_all_tests(output_dir, machine, exe_path)
+            self.run_pipelined(compare_dir, max_cores, test_workers)
         else:
             self.prepare_all_tests(output_dir, machine, exe_path)
-            if not test_only: self.run_all_sims()
-            if not sim_only: self.run_all_tests(compare_dir)
+            if not test_only: self.run_all_sims(max_cores)
+            if not sim_only: self.run_all_tests(compare_dir, test_workers)
         if not sim_only: self.save_test_summary()
+        if retention != 'keep' and not sim_only:
+            freed = 0
+            for my_test in self.test_container:
+                freed += my_test.apply_retention(retention)
+            print "Retention policy '%s' freed %0.1f MB." % \
+                (retention, freed / 1024.0**2)
+        if quota is not None: self.enforce_quota(quota)
         go_stop_time = time.time()
+        if events is not None:
+            events.emit('suite_finished',
+                        total_time = go_stop_time - go_start_time,
+                        passed = len([t for t in self.test_container
+                                      if t.passed()]))
         print "\n\nComplete!"
         print "Total time: %f seconds." % (go_stop_time - go_start_time)
         print "See %s/%s for a summary of all tests." % \
             (self.output_dir, results_filename)
 
+    def enforce_quota(self, quota):
+        """Deletes output dumps of passing tests, largest first, until
+        everything under output_dir fits in quota bytes.  Failed and
+        unfinished runs are left alone for debugging."""
+        usage = _disk_usage(self.output_dir)
+        if usage <= quota: return
+        candidates = []
+        seen = set()
+        for my_test in self.test_container:
+            if not my_test.passed(): continue
+            dumps = _list_dumps(my_test.run_dir)
+            for name in os.listdir(my_test.run_dir):
+                path = os.path.join(my_test.run_dir, name)
+                if name in dumps or name.endswith(".tar.gz"):
+                    candidates.append((_disk_usage(path, seen), path))
+        for size, path in sorted(candidates, reverse=True):
+            if usage <= quota: break
+            print "Removing %s to stay within the disk quota." % path
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+            usage -= size
+        if usage > quota:
+            print "Still using %0.1f MB of a %0.1f MB quota." % \
+                (usage / 1024.0**2, quota / 1024.0**2)
+
+    def benchmark(self, output_dir, machine, exe_path, repeats, max_cores=1):
+        """Runs every simulation repeats times in output_dir/benchmark and
+        returns {test: {metric: [samples]}} with the wall time, peak memory
+        (not known for batch runs) and lcaperf time of each region, also
+        saving it to benchmark.json."""
+        # Batch machines keep their job scripts under output_dir.
+        self.output_dir = output_dir
+        samples = {}
+        for k in range(repeats):
+            print "Benchmark pass %d of %d." % (k + 1, repeats)
+            bench_dir = os.path.join(output_dir, "benchmark", "run%d" % k)
+            # Runs left by an earlier --benchmark would be skipped and their
+            # old timings reported as new samples.
+            if os.path.exists(bench_dir): shutil.rmtree(bench_dir)
+            os.makedirs(bench_dir)
+            shutil.copy(os.path.join(output_dir, version_filename),
+                        os.path.join(bench_dir, version_filename))
+            self.test_container = []
+            for my_test in self.tests:
+                bench_run = EnzoTestRun(bench_dir, my_test, machine, exe_path)
+                # Cached outputs would say nothing about this binary's speed.
+                bench_run.use_cache = False
+                self.test_container.append(bench_run)
+            self.run_all_sims(max_cores)
+            for my_test in self.test_container:
+                if not os.path.exists(os.path.join(my_test.run_dir,
+                                                   'RunFinished')):
+                    continue
+                usage = my_test.usage()
+                metrics = samples.setdefault(my_test.test_data['fulldir'], {})
+                for metric in ['wall_time', 'peak_rss_kb']:
+                    if usage.get(metric) is None: continue
+                    metrics.setdefault(metric, []).append(usage[metric])
+                for region, seconds in _read_lcaperf(my_test.run_dir).items():
+                    metrics.setdefault('lcaperf:' + region, []).append(seconds)
+        f = open(os.path.join(output_dir, benchmark_filename), 'w')
+        json.dump(samples, f, indent=1, sort_keys=True)
+        f.close()
+        return samples
+
     def prepare_all_tests(self, output_dir, machine, exe_path):
         print "Preparing all tests."
         for my_test in self.tests:
             print "Preparing test: %s." % my_test['name']
-            self.test_container.append(EnzoTestRun(output_dir, my_test, 
-                                                   machine, exe_path))
+            self._prepare_test(output_dir, my_test, machine, exe_path)
 
-    def run_all_sims(self):
+    def _prepare_test(self, output_dir, test_data, machine, exe_path):
+        my_test = EnzoTestRun(output_dir, test_data, machine, exe_path)
+        my_test.events = self.events
+        my_test.emit('test_queued', name = test_data['name'],
+                     nprocs = test_data['nprocs'],
+                     expected_time = _expected_time(test_data, self.history))
+        self.test_container.append(my_test)
+
+    def run_all_sims(self, max_cores=1, on_finish=None):
+        if self.test_container and \
+                'scheduler' in machines[self.test_container[0].machine]:
+            return self.run_batch_sims(max_cores, on_finish)
         total_tests = len(self.test_container)
-        print "Running all simulations."
-        for i, my_test in enumerate(self.test_container):
-            print "Running simulation: %d of %d." % (i, total_tests)
-            my_test.run_sim()
+        print "Running all simulations with up to %d cores." % max_cores
+        # Longest jobs go first so the suite does not end waiting on one
+        # straggler; shorter ones are used to fill the gaps.
+        pending = _schedule_order(enumerate(self.test_container),
+                                  self.history,
+                                  key=lambda item: item[1].test_data)
+        supervisor = SimulationSupervisor()
+        free_cores = max_cores
+        # Tests whose recorded peak memory would not fit next to the ones
+        # already running wait, so that they do not push each other into
+        # swap.
+        free_memory = _total_memory_kb()
+        memory = {}
+        try:
+            while pending or supervisor.running:
+                for item in pending[:]:
+                    i, my_test = item
+                    nprocs = my_test.test_data['nprocs']
+                    # A test wider than the whole budget gets the machine
+                    # to itself.
+                    if nprocs > free_cores and \
+                            not (nprocs > max_cores and not supervisor.running):
+                        continue
+                    needed = _expected_memory(my_test.test_data, self.history)
+                    if needed is not None and free_memory is not None and \
+                            needed > free_memory and supervisor.running:
+                        continue
+                    pending.remove(item)
+                    print "Running simulation: %d of %d." % (i, total_tests)
+                    if my_test.start_sim():
+                        supervisor.add(my_test)
+                        free_cores -= nprocs
+                        if needed is not None and free_memory is not None:
+                            memory[my_test] = needed
+                            free_memory -= needed
+                    elif on_finish is not None:
+                        on_finish(my_test)
+                if supervisor.running:
+                    for my_test in supervisor.wait():
+                        free_cores += my_test.test_data['nprocs']
+                        if my_test in memory:
+                            free_memory += memory.pop(my_test)
+                        if self.history is not None and my_test.sim_finished:
+                            self.history.record(my_test)
+                        if on_finish is not None: on_finish(my_test)
+        finally:
+            supervisor.close()
+            if self.history is not None: self.history.save()
+
+    def run_batch_sims(self, max_cores=1, on_finish=None):
+        """Submits the simulations to the machine's batch scheduler as one
+        job array per nprocs and polls all of them together."""
+        machine = self.test_container[0].machine
+        scheduler = batch_schedulers[machines[machine]['scheduler']](
+            machine, os.path.join(self.output_dir, "batch"), max_cores)
+        groups = {}
+        for my_test in self.test_container:
+            print "Preparing simulation: %s." % my_test.test_data['fulldir']
+            if my_test.needs_sim():
+                groups.setdefault(my_test.test_data['nprocs'], []).append(my_test)
+            elif on_finish is not None:
+                on_finish(my_test)
+        for nprocs, tests in sorted(groups.items()):
+            job_id = scheduler.submit(_schedule_order(tests, self.history,
+                                          key=lambda t: t.test_data))
+            print "Submitted %d simulations on %d cores as job %s." % \
+                (len(tests), nprocs, job_id)
+        try:
+            while scheduler.active():
+                time.sleep(scheduler.poll_interval)
+                for my_test in scheduler.poll():
+                    my_test._finish_batch_sim()
+                    if self.history is not None and my_test.sim_finished and \
+                            my_test.sim_usage is not None:
+                        self.history.record(my_test)
+                    if on_finish is not None: on_finish(my_test)
+        finally:
+            if self.history is not None: self.history.save()
 
-    def run_all_tests(self, compare_dir):
+    def run_pipelined(self, compare_dir, max_cores=1, test_workers=1):
+        """Runs the simulations and hands each one to the answer tests as
+        soon as it finishes, so testing overlaps the remaining runs."""
+        print "Running all simulations and tests pipelined."
+        pool = AnswerTestPool(test_workers)
+        try:
+            self.run_all_sims(max_cores, on_finish=lambda my_test:
+                              pool.submit(my_test, compare_dir))
+            pool.collect()
+        finally:
+            pool.close()
+
+    def run_all_tests(self, compare_dir, test_workers=1):
         total_tests = len(self.test_container)
-        print "Running all tests."
-        for i, my_test in enumerate(self.test_container):
-            print "Running test: %d of %d." % (i, total_tests)
-            my_test.run_test(compare_dir)
+        print "Running all tests with %d workers." % test_workers
+        pool = AnswerTestPool(test_workers)
+        try:
+            for i, my_test in enumerate(self.test_container):
+                print "Running test: %d of %d." % (i, total_tests)
+                pool.submit(my_test, compare_dir)
+            pool.collect()
+        finally:
+            pool.close()
 
     def add_test(self, fn):
-        # We now do something dangerous: we exec the file directly and grab
-        # its environment variables from it.
-        local_vars = {}
-        execfile(fn, {}, local_vars)
+        local_vars = self.manifest.variables(fn)
         test_spec = variable_defaults.copy()
         test_spec['fullpath'] = fn
         test_spec['fulldir'] = os.path.dirname(fn)
@@ -198,11 +1173,18 @@ class EnzoTestCollection(object):
                 print "%s UNRECOGNIZED VARIABLE %s" % ( fn, var)
         self.tests.append(test_spec)
 
+    def index(self, param):
+        """Returns an inverted index of param: a dict mapping each value to
+        the set of positions in self.tests that have it."""
+        if param not in self._indexes:
+            idx = {}
+            for i, t in enumerate(self.tests):
+                idx.setdefault(t.get(param, "Key Missing"), set()).add(i)
+            self._indexes[param] = idx
+        return self._indexes[param]
+
     def unique(self, param):
-        pp = set()
-        for t in self.tests:
-            pp.add(t.get(param, "Key Missing"))
-        return pp
+        return set(self.index(param).keys())
 
     def params(self):
         pp = set()
@@ -210,18 +1192,55 @@ class EnzoTestCollection(object):
             pp.update(set(t.keys()))
         return pp
 
+    def _subset(self, ids):
+        return EnzoTestCollection(tests = [self.tests[i] for i in sorted(ids)])
+
     def select(self, **kwargs):
-        pp = []
-        for t in self.tests:
-            include = True
-            for param, value in kwargs.items():
-                if value == "None": value = None
-                if value == "False": value = False
-                if t.get(param, "Key Missing") != value:
-                    include = False
-                    break
-            if include == True: pp.append(t)
-        return EnzoTestCollection(tests = pp)
+        ids = set(range(len(self.tests)))
+        for param, value in kwargs.items():
+            if value == "None": value = None
+            if value == "False": value = False
+            ids &= self.index(param).get(value, set())
+        return self._subset(ids)
+
+    def select_budget(self, budget, max_cores=1, history=None):
+        """Returns the most valuable tests that are predicted to run within
+        budget seconds on max_cores, picked greedily by value per core-second."""
+        ranked = sorted(self.tests, key=lambda t: -_test_value(t) /
+                        (max(_expected_time(t, history), 1.0) * t['nprocs']))
+        chosen = []
+        for test_data in ranked:
+            if predict_makespan(chosen + [test_data], max_cores,
+                                history) <= budget:
+                chosen.append(test_data)
+        chosen_ids = set([id(t) for t in chosen])
+        return EnzoTestCollection(tests = [t for t in self.tests
+                                           if id(t) in chosen_ids])
+
+    def select_shard(self, index, count, run_id, max_cores=1, history=None):
+        """Returns shard index (from 1) of count, splitting the tests so
+        that each shard's predicted makespan on max_cores is about the
+        same.  Every node must compute the same split, so history should be
+        a snapshot that no runner writes to, or None to split by
+        max_time_minutes.  run_id names this run of the shards in their
+        saved results."""
+        shards = [[] for i in range(count)]
+        for test_data in _schedule_order(self.tests, history):
+            # Hand the next longest test to the shard that would finish first.
+            finish = [(predict_makespan(shard + [test_data], max_cores,
+                                        history), i)
+                      for i, shard in enumerate(shards)]
+            shards[min(finish)[1]].append(test_data)
+        chosen_ids = set([id(t) for t in shards[index - 1]])
+        etc = EnzoTestCollection(tests = [t for t in self.tests
+                                          if id(t) in chosen_ids])
+        etc.shard = (index, count, run_id)
+        return etc
+
+    def query(self, expression):
+        """Selects the tests matching a boolean expression over the test
+        keywords, e.g. "nprocs <= 4 and (hydro or mhd)".  See TestQuery."""
+        return self._subset(TestQuery(expression).evaluate(self))
 
     def summary(self):
         for param in sorted(self.params()):
@@ -234,44 +1253,278 @@ class EnzoTestCollection(object):
         print "NUMBER OF TESTS", len(self.tests)
 
     def save_test_summary(self):
-        all_passes = all_failures = 0
-        run_passes = run_failures = 0
-        dnfs = default_test = 0
-        f = open(os.path.join(self.output_dir, results_filename), 'w')
+        rows = []
         for my_test in self.test_container:
             default_only = False
             if my_test.run_finished:
                 if my_test.test_data['answer_testing_script'] == 'None' or \
                         my_test.test_data['answer_testing_script'] is None:
                     default_only = True
-                    default_test += 1
-                t_passes = 0
-                t_failures = 0
-                for t_result in my_test.results.values():
-                    t_passes += int(t_result)
-                    t_failures += int(not t_result)
-                f.write("%-70sPassed: %4d, Failed: %4d" % (my_test.test_data['fulldir'], 
-                                                           t_passes, t_failures))
-                if default_only:
-                    f.write(" (default tests).\n")
-                else:
-                    f.write(".\n")
-                all_passes += t_passes
-                all_failures += t_failures
-                run_passes += int(not (t_failures > 0))
-                run_failures += int(t_failures > 0)
+            rows.append(dict(fulldir = my_test.test_data['fulldir'],
+                             run_finished = my_test.run_finished,
+                             diverged = my_test.divergence(),
+                             passed = len([r for r in my_test.results.values()
+                                           if r]),
+                             failed = len([r for r in my_test.results.values()
+                                           if not r]),
+                             default_only = default_only,
+                             unavailable = my_test.tests_unavailable))
+            if self.results_db is not None:
+                self.results_db.record(my_test, default_only)
+        if self.results_db is not None: self.results_db.commit()
+        if self.shard is None:
+            _write_summary(os.path.join(self.output_dir, results_filename),
+                           rows)
+            return
+        # Each shard leaves its rows behind; whichever shard finishes last
+        # finds them all and writes the combined summary.
+        index, count, run_id = self.shard
+        _save_json(os.path.join(self.output_dir,
+                                shard_filename % (index, count)),
+                   dict(run_id = run_id, rows = rows))
+        rows = []
+        missing = 0
+        for i in range(1, count + 1):
+            partial = self._load_shard(i)
+            if partial is None or partial['run_id'] != run_id:
+                missing += 1
+                continue
+            rows += partial['rows']
+        if missing:
+            print "Waiting on %d more shards for %s." % \
+                (missing, results_filename)
+            return
+        rows.sort(key = lambda row: row['fulldir'])
+        _write_summary(os.path.join(self.output_dir, results_filename), rows)
+
+    def _load_shard(self, i):
+        fn = os.path.join(self.output_dir, shard_filename % (i, self.shard[1]))
+        if not os.path.exists(fn): return None
+        f = open(fn)
+        try:
+            partial = json.load(f)
+        finally:
+            f.close()
+        if not isinstance(partial, dict): return None
+        return partial
+
+    def _clear_stale_shards(self):
+        """Removes results left in the output directory by another run of
+        the shards, so that they are never merged with this run's."""
+        index, count, run_id = self.shard
+        for i in range(1, count + 1):
+            partial = self._load_shard(i)
+            fn = os.path.join(self.output_dir, shard_filename % (i, count))
+            if os.path.exists(fn) and \
+                    (i == index or partial is None or
+                     partial['run_id'] != run_id):
+                os.remove(fn)
+
+def _save_json(filename, data):
+    tmp_filename = "%s.%d" % (filename, os.getpid())
+    f = open(tmp_filename, 'w')
+    json.dump(data, f, indent=1, sort_keys=True)
+    f.close()
+    os.rename(tmp_filename, filename)
+
+def _write_summary(filename, rows):
+    """Writes the test_results.txt summary from one row per test."""
+    all_passes = all_failures = 0
+    run_passes = run_failures = 0
+    dnfs = default_test = diverged = unavailable = 0
+    f = open(filename, 'w')
+    for row in rows:
+        if row['run_finished'] and row.get('unavailable'):
+            unavailable += 1
+            f.write("%-70sANSWER TESTS UNAVAILABLE\n" % row['fulldir'])
+        elif row['run_finished']:
+            if row['default_only']: default_test += 1
+            f.write("%-70sPassed: %4d, Failed: %4d" % (row['fulldir'], 
+                                                       row['passed'],
+                                                       row['failed']))
+            if row['default_only']:
+                f.write(" (default tests).\n")
             else:
-                dnfs += 1
-                f.write("%-70sDID NOT FINISH\n" % my_test.test_data['fulldir'])
-
-        f.write("\n")
-        f.write("%-70sPassed: %4d, Failed: %4d.\n" % ("Total", 
-                                                      all_passes, all_failures))
-        f.write("Runs finished with all tests passed: %d.\n" % run_passes)
-        f.write("Runs finished with at least one failure: %d.\n" % run_failures)
-        f.write("Runs failed to complete: %d.\n" % dnfs)
-        f.write("Runs finished with only default tests available: %d.\n" % default_test)
+                f.write(".\n")
+            all_passes += row['passed']
+            all_failures += row['failed']
+            run_passes += int(not (row['failed'] > 0))
+            run_failures += int(row['failed'] > 0)
+        elif row.get('diverged'):
+            diverged += 1
+            f.write("%-70sDIVERGED: %s\n" % (row['fulldir'], row['diverged']))
+        else:
+            dnfs += 1
+            f.write("%-70sDID NOT FINISH\n" % row['fulldir'])
+
+    f.write("\n")
+    f.write("%-70sPassed: %4d, Failed: %4d.\n" % ("Total", 
+                                                  all_passes, all_failures))
+    f.write("Runs finished with all tests passed: %d.\n" % run_passes)
+    f.write("Runs finished with at least one failure: %d.\n" % run_failures)
+    f.write("Runs failed to complete: %d.\n" % dnfs)
+    if diverged:
+        f.write("Runs stopped early for diverging: %d.\n" % diverged)
+    if unavailable:
+        f.write("Runs finished without answer tests (yt does not support testing): %d.\n" % unavailable)
+    f.write("Runs finished with only default tests available: %d.\n" % default_test)
+    f.close()
+
+def compare_benchmarks(current, baseline, threshold, filename=None):
+    """Prints, and optionally writes to filename, every metric of every test
+    in current that is significantly slower or bigger than in baseline.
+    Returns the number of regressions found."""
+    lines = []
+    for test in sorted(current):
+        if test not in baseline: continue
+        for metric in sorted(current[test]):
+            if metric not in baseline[test]: continue
+            new = current[test][metric]
+            old = baseline[test][metric]
+            if is_slowdown(new, old, threshold):
+                lines.append("%-60s%-30s%12.4g -> %12.4g (%+.1f%%)" %
+                             (test, metric, _mean_var(old)[0],
+                              _mean_var(new)[0], 100.0 *
+                              (_mean_var(new)[0] / _mean_var(old)[0] - 1)))
+    if lines:
+        print "Performance regressions:"
+        print "\n".join(lines)
+    else:
+        print "No performance regressions."
+    if filename is not None:
+        f = open(filename, 'w')
+        for line in lines: f.write(line + "\n")
         f.close()
+    return len(lines)
+
+class EnzoBisect(object):
+    """Finds the first revision between a good and a bad one at which a
+    test fails its answer tests against compare_dir or, if repeats is set,
+    becomes significantly slower than at the good revision.  Each revision
+    is built once into build_dir, from an hg archive so the working copy is
+    untouched, and is tested in output_dir/<revision>, so a repeated or
+    interrupted bisection reuses earlier builds and results."""
+
+    def __init__(self, tests, repository, output_dir, build_dir, machine,
+                 compare_dir=None, max_cores=1, repeats=None, threshold=0.05):
+        self.tests = tests
+        self.repository = repository
+        self.output_dir = output_dir
+        self.build_dir = build_dir
+        self.machine = machine
+        self.compare_dir = compare_dir
+        self.max_cores = max_cores
+        self.repeats = repeats
+        self.threshold = threshold
+        self.baseline = None
+
+    def revisions(self, good, bad):
+        """The revisions from good to bad, oldest first."""
+        proc = subprocess.Popen(["hg", "log", "-R", self.repository, "-r",
+                                 "%s::%s" % (good, bad), "--template",
+                                 "{node|short}\n"], stdout=subprocess.PIPE)
+        output = proc.communicate()[0]
+        if proc.returncode != 0:
+            raise RuntimeError("Could not list revisions %s..%s." % (good, bad))
+        return output.split()
+
+    def build(self, rev):
+        """Returns the path to enzo.exe built at rev, or None if it does not
+        build.  The build is keyed by the machine configuration as well, so
+        changing Make.config.machine or Make.config.override rebuilds."""
+        config = hashlib.sha1()
+        src_dir = os.path.join(self.repository, "src", "enzo")
+        config_files = ["Make.config.machine", "Make.config.override"]
+        for fn in config_files:
+            if os.path.exists(os.path.join(src_dir, fn)):
+                config.update(open(os.path.join(src_dir, fn)).read())
+        build = os.path.join(self.build_dir, "%s-%s" % (rev, config.hexdigest()[:8]))
+        exe_path = os.path.join(build, "enzo.exe")
+        if os.path.exists(exe_path): return exe_path
+        if os.path.exists(os.path.join(build, "FAILED")): return None
+        print "Building revision %s." % rev
+        if not os.path.exists(build): os.makedirs(build)
+        tree = os.path.join(build, "src")
+        if os.path.exists(tree): shutil.rmtree(tree)
+        log = open(os.path.join(build, "build.log"), 'w')
+        status = subprocess.call(["hg", "archive", "-R", self.repository,
+                                  "-r", rev, tree], stdout=log, stderr=log)
+        if status == 0:
+            status = subprocess.call(["csh", "-f", "configure"], cwd=tree,
+                                     stdout=log, stderr=log)
+        if status == 0:
+            for fn in config_files:
+                if os.path.exists(os.path.join(src_dir, fn)):
+                    shutil.copy(os.path.join(src_dir, fn),
+                                os.path.join(tree, "src", "enzo", fn))
+            status = subprocess.call(["make", "-j%d" % self.max_cores],
+                                     cwd=os.path.join(tree, "src", "enzo"),
+                                     stdout=log, stderr=log)
+        log.close()
+        if status == 0:
+            shutil.copy2(os.path.join(tree, "src", "enzo", "enzo.exe"),
+                         exe_path)
+            shutil.rmtree(tree)
+            return exe_path
+        print "Revision %s failed to build, see %s." % \
+            (rev, os.path.join(build, "build.log"))
+        open(os.path.join(build, "FAILED"), 'w').close()
+        return None
+
+    def is_bad(self, rev):
+        """True if the test fails at rev, False if it passes and None if rev
+        cannot be tested."""
+        exe_path = self.build(rev)
+        if exe_path is None: return None
+        run_dir = os.path.join(self.output_dir, rev)
+        if not os.path.exists(run_dir): os.makedirs(run_dir)
+        f = open(os.path.join(run_dir, version_filename), 'w')
+        f.write("%s\n" % rev)
+        f.close()
+        etc = EnzoTestCollection(tests = self.tests)
+        if self.repeats is not None:
+            fn = os.path.join(run_dir, benchmark_filename)
+            if os.path.exists(fn):
+                samples = json.load(open(fn))
+            else:
+                samples = etc.benchmark(run_dir, self.machine, exe_path,
+                                        self.repeats, self.max_cores)
+            if self.baseline is None:
+                self.baseline = samples
+                return False
+            return compare_benchmarks(samples, self.baseline,
+                                      self.threshold) > 0
+        etc.go(run_dir, False, self.machine, exe_path, self.compare_dir,
+               max_cores = self.max_cores)
+        return not all([my_test.passed() for my_test in etc.test_container])
+
+    def run(self, good, bad):
+        """Returns the first bad revision, or None if it could not be
+        pinned down."""
+        revs = self.revisions(good, bad)
+        if len(revs) < 2:
+            print "No revisions between %s and %s." % (good, bad)
+            return None
+        if self.repeats is not None and self.is_bad(revs[0]) is None:
+            print "Good revision %s does not build." % revs[0]
+            return None
+        # revs[lo] is known good and revs[hi] known bad; untestable
+        # revisions are dropped as they are found.
+        lo, hi = 0, len(revs) - 1
+        while hi - lo > 1:
+            mid = (lo + hi) / 2
+            print "Bisecting: %d revisions left, testing %s." % \
+                (hi - lo - 1, revs[mid])
+            bad = self.is_bad(revs[mid])
+            if bad is None:
+                del revs[mid]
+                hi -= 1
+            elif bad:
+                hi = mid
+            else:
+                lo = mid
+        print "First bad revision: %s (last good: %s)." % (revs[hi], revs[lo])
+        return revs[hi]
 
 class EnzoTestRun(object):
     def __init__(self, test_dir, test_data, machine, exe_path):
@@ -280,12 +1533,20 @@ class EnzoTestRun(object):
         self.test_data = test_data
         self.exe_path = exe_path
         self.results = {}
+        self.values = {}
+        self.tests_unavailable = False
+        self.sim_finished = False
+        self.sim_usage = None
+        self.cache = None
+        self.use_cache = True
+        self.events = None
         if self.exe_path is None:
             self.local_exe = None
         else:
             self.local_exe = os.path.basename(exe_path)
 
-        self.run_dir = os.path.join(self.test_dir, self.test_data['fulldir'])
+        self.run_dir = os.path.abspath(os.path.join(self.test_dir,
+                                                    self.test_data['fulldir']))
 
         self._copy_test_files()
         self._create_run_script()
@@ -296,21 +1557,30 @@ class EnzoTestRun(object):
             if options.clobber:
                 print "%s exists, but clobber == True, so overwriting it." % self.test_data['name']
                 shutil.rmtree(self.run_dir)
-                shutil.copytree(self.test_data['fulldir'], self.run_dir)
-                # Copy version file into run directory
-                shutil.copy(os.path.join(self.test_dir, version_filename),
-                            os.path.join(self.run_dir, version_filename))
-                if self.exe_path is not None:
-                    shutil.copy(self.exe_path, os.path.join(self.run_dir, self.local_exe))
             else:
                 print "%s already exists. Skipping directory." % self.test_data['name']
-        else:
-            shutil.copytree(self.test_data['fulldir'], self.run_dir)
-            # Copy version file into run directory
-            shutil.copy(os.path.join(self.test_dir, version_filename),
-                        os.path.join(self.run_dir, version_filename))
-            if self.exe_path is not None:
-                shutil.copy(self.exe_path, os.path.join(self.run_dir, self.local_exe))
+                return
+        _stage_tree(self.test_data['fulldir'], self.run_dir, options.stage)
+        # Modules shared by the tests of a category, such as
+        # RadiationTransportFLD/fld_verify.py, go in the same place relative
+        # to the run directory.
+        parent = os.path.dirname(self.test_data['fulldir'])
+        while parent:
+            for fn in glob.glob(os.path.join(parent, "*.py")):
+                dst = os.path.join(self.test_dir, fn)
+                if os.path.lexists(dst): os.remove(dst)
+                _stage_file(fn, dst, options.stage)
+                _protect_staged(dst)
+            parent = os.path.dirname(parent)
+        # Copy version file into run directory.  It is always a copy, as the
+        # revision directory's own is rewritten by every run.
+        shutil.copy(os.path.join(self.test_dir, version_filename),
+                    os.path.join(self.run_dir, version_filename))
+        if self.exe_path is not None:
+            _stage_file(self.exe_path, os.path.join(self.run_dir, self.local_exe),
+                        options.stage)
+        # Only what the run creates should be writable.
+        _protect_staged(self.run_dir)
 
     def _create_run_script(self):
         template_path = os.path.join(os.path.dirname(__file__), 
@@ -329,92 +1599,226 @@ class EnzoTestRun(object):
         f.write(template)
         f.close()
 
-    def run_sim(self):
-        print "Running test simulation: %s." % self.test_data['fulldir']
-        cur_dir = os.getcwd()
+    def emit(self, event, **fields):
+        if self.events is not None:
+            self.events.emit(event, self.test_data['fulldir'], **fields)
+
+    def needs_sim(self):
+        """False if the simulation already finished in this run directory,
+        or identical outputs could be taken from the cache."""
         # Check for existence
         if os.path.exists(os.path.join(self.run_dir, 'RunFinished')):
             print "%s run already completed, continuing..." % self.test_data['name']
-            return
-        
-        os.chdir(self.run_dir)
+            self.emit('sim_skipped', reason = 'finished')
+            return False
+
+        if options.cache_dir is not None and self.exe_path is not None \
+                and self.use_cache:
+            self.cache = SimulationCache(options.cache_dir)
+            self.cache_key = self.cache.key(self)
+            if self.cache.fetch(self.cache_key, self.run_dir, options.stage):
+                print "%s reused cached simulation %s." % \
+                    (self.test_data['name'], self.cache_key)
+                self.emit('sim_skipped', reason = 'cached')
+                return False
+        return True
+
+    def start_sim(self):
+        """Launch the simulation without waiting for it.  Returns False if
+        there is nothing to run because the test already finished."""
+        print "Running test simulation: %s." % self.test_data['fulldir']
+        if not self.needs_sim(): return False
+
         command = "%s %s" % (machines[self.machine]['command'], 
                              machines[self.machine]['script'])
-        sim_start_time = time.time()
+        self.sim_start_time = time.time()
         # Run the command.
-        proc = subprocess.Popen(command, shell=True, close_fds=True, 
-                                preexec_fn=os.setsid)
+        self.proc = subprocess.Popen(command, shell=True, close_fds=True, 
+                                     preexec_fn=os.setsid, cwd=self.run_dir)
+
+        self.sim_deadline = self.sim_start_time + \
+            self.test_data['max_time_minutes'] * 60
+        self.sim_signalled = False
+        self.peak_rss = 0
+        self.checked_dumps = set()
+        self.divergence_checked = 0.0
+        if os.path.exists(os.path.join(self.run_dir, divergence_filename)):
+            os.remove(os.path.join(self.run_dir, divergence_filename))
 
         print "Simulation started on %s with maximum run time of %d seconds." % \
             (time.ctime(), (self.test_data['max_time_minutes'] * 60))
-        running = 0
-        # Kill the script if the max run time exceeded.
-        while proc.poll() is None:
-            if running > (self.test_data['max_time_minutes'] * 60):
-                print "Simulation exceeded maximum run time."
-                os.killpg(proc.pid, signal.SIGUSR1)
-            running += 1
-            time.sleep(1)
-        
+        self.emit('sim_started', pid = self.proc.pid,
+                  deadline = self.sim_deadline)
+        return True
+
+    def _finish_sim(self, status, rusage):
         sim_stop_time = time.time()
-        if os.path.exists(os.path.join(self.run_dir, 'RunFinished')):
+        wall_time = sim_stop_time - self.sim_start_time
+        # ru_maxrss only covers the largest single descendant, so keep the
+        # sampled process-group total if that was bigger.
+        self.sim_usage = dict(wall_time = wall_time,
+                              cpu_time = rusage.ru_utime + rusage.ru_stime,
+                              peak_rss_kb = max(self.peak_rss, rusage.ru_maxrss),
+                              exit_status = status)
+        f = open(os.path.join(self.run_dir, usage_filename), 'w')
+        for key in ['wall_time', 'cpu_time', 'peak_rss_kb', 'exit_status']:
+            f.write("%s = %s\n" % (key, self.sim_usage[key]))
+        f.close()
+        self.sim_finished = \
+            os.path.exists(os.path.join(self.run_dir, 'RunFinished'))
+        self.emit('sim_finished', finished = self.sim_finished,
+                  **self.sim_usage)
+        if self.sim_finished:
             f = open(os.path.join(self.run_dir, 'run_time'), 'w')
-            f.write("%f seconds.\n" % (sim_stop_time - sim_start_time))
+            f.write("%f seconds.\n" % wall_time)
             f.close()
-            print "Simulation completed in %f seconds." % \
-                (sim_stop_time - sim_start_time)
-        os.chdir(cur_dir)
+            print "Simulation %s completed in %f seconds." % \
+                (self.test_data['name'], wall_time)
+            self._cache_outputs()
 
-    def run_test(self, compare_dir):
-        cur_dir = os.getcwd()
-        if compare_dir is None:
-            compare_id = None
-        else:
-            compare_id = ""
-            compare_dir = os.path.join(cur_dir, compare_dir,
-                            self.test_data['fulldir'])
-        os.chdir(self.run_dir)
-        print "Running test: %s" % self.test_data['fulldir']
-        self.run_finished = os.path.exists("RunFinished")
-
-        if os.path.exists(results_filename):
-            if self.run_finished:
-                print "Reading test results from file."
-                res_lines = file(results_filename)
-                for line in res_lines:
-                    if len(line.split()) == 2:
-                        this_test, this_result = line.split()
-                        self.results[this_test] = bool(this_result)
+    def check_divergence(self, stop=None):
+        """Compares each output dump the simulation has finished writing
+        with the dump of the same directory name in the --compare-dir run,
+        file by file.  Returns a reason
+        string, also saved in the run directory, if a field differs by more
+        than --abort-divergence; otherwise None.  No new dump is started
+        after time stop; the rest are left for the next call."""
+        if options.abort_divergence is None or options.compare_dir is None:
+            return None
+        self.divergence_checked = time.time()
+        baseline_dir = os.path.join(os.getcwd(), options.compare_dir,
+                                    self.test_data['fulldir'])
+        # A dump is complete once a newer one has been started.
+        dumps = _list_dumps(self.run_dir)[:-1]
+        for dump in dumps:
+            if dump in self.checked_dumps: continue
+            if stop is not None and time.time() >= stop: break
+            self.checked_dumps.add(dump)
+            baseline = os.path.join(baseline_dir, dump)
+            if not os.path.isdir(baseline):
+                print "Not checking %s of %s for divergence: %s does not " \
+                    "exist (--retention may have removed it)." % \
+                    (dump, self.test_data['name'], baseline)
+                continue
+            divergence = _dump_divergence(os.path.join(self.run_dir, dump),
+                                          baseline)
+            if divergence is None: continue
+            difference, field = divergence
+            if difference <= options.abort_divergence: continue
+            reason = "%s %s differs by %g" % (dump, field, difference)
+            f = open(os.path.join(self.run_dir, divergence_filename), 'w')
+            f.write("%s\n" % reason)
+            f.close()
+            return reason
+        return None
+
+    def passed(self):
+        return bool(getattr(self, 'run_finished', False) and self.results and
+                    all(self.results.values()) and self.divergence() is None)
 
+    def needed_dumps(self):
+        """The dump directories answer testing reads: the newest, which the
+        default field and projection tests load, and any whose name (e.g.
+        DD0010 in "DD0010/data0010") appears in the test directory's
+        scripts."""
+        dumps = _list_dumps(self.run_dir)
+        needed = set(dumps[-1:])
+        for fn in glob.glob(os.path.join(self.test_data['fulldir'], "*.py")):
+            # Whole words only, not names that appear inside longer ones.
+            names = set(re.findall(r"\w+", open(fn).read()))
+            needed.update([dump for dump in dumps if dump in names])
+        return needed
+
+    def apply_retention(self, mode):
+        """Once a test has passed, compresses ('compress') or deletes
+        ('prune') the dumps answer testing does not need.  Returns the
+        number of bytes freed."""
+        if mode == 'keep' or not self.passed(): return 0
+        needed = self.needed_dumps()
+        freed = 0
+        for dump in _list_dumps(self.run_dir):
+            if dump in needed: continue
+            path = os.path.join(self.run_dir, dump)
+            freed += _disk_usage(path)
+            if mode == 'compress':
+                tar = tarfile.open(path + ".tar.gz", "w:gz")
+                tar.add(path, dump)
+                tar.close()
+                freed -= _disk_usage(path + ".tar.gz")
+            shutil.rmtree(path)
+        return freed
+
+    def divergence(self):
+        """Returns why the last simulation in this run directory was
+        stopped for diverging, or None."""
+        fn = os.path.join(self.run_dir, divergence_filename)
+        if not os.path.exists(fn): return None
+        return open(fn).read().strip()
+
+    def _finish_batch_sim(self):
+        """Called once a batch scheduler no longer knows the job.  The array
+        task script writes the wall time and exit status to run_usage; a
+        task the queue killed leaves none."""
+        usage = self.usage()
+        if 'wall_time' in usage:
+            self.sim_usage = dict(wall_time = usage['wall_time'],
+                                  cpu_time = None, peak_rss_kb = None,
+                                  exit_status = usage.get('exit_status'))
         else:
-            fn = self.test_data['answer_testing_script']
-            if RegressionTestRunner is None:
-                print "This installation of yt does not support testing, please update to the branch 'yt'."
-                return
-            clear_registry()
-
-            handler = logging.FileHandler("testing.log")
-            f = logging.Formatter(ufstring)
-            handler.setFormatter(f)
-            mylog.addHandler(handler)
-            if self.run_finished:
-                if fn != 'None' and fn is not None:
-                    if fn.endswith(".py"): fn = fn[:-3]
-                    print "Loading module %s" % (fn)
-                    f, filename, desc = imp.find_module(fn, ["."])
-                    project = imp.load_module(fn, f, filename, desc)
-                if fn is None or fn == "None":
-                    create_test(TestFieldStatistics, "field_stats", tolerance = 1e-10)
-                    create_test(TestAllProjections, "all_projs", tolerance = 1e-10)
-                rtr = RegressionTestRunner("", compare_id,
-                            compare_results_path = compare_dir)
-                rtr.run_all_tests()
-                self.results = rtr.passed_tests.copy()
-            mylog.removeHandler(handler)
-            handler.close()
-
-        os.chdir(cur_dir)
-        self.save_results()
+            self.sim_usage = None
+        self.sim_finished = \
+            os.path.exists(os.path.join(self.run_dir, 'RunFinished'))
+        self.emit('sim_finished', finished = self.sim_finished,
+                  **(self.sim_usage or {}))
+        if self.sim_finished:
+            if self.sim_usage is None:
+                print "Simulation %s completed." % self.test_data['name']
+            else:
+                f = open(os.path.join(self.run_dir, 'run_time'), 'w')
+                f.write("%f seconds.\n" % self.sim_usage['wall_time'])
+                f.close()
+                print "Simulation %s completed in %f seconds." % \
+                    (self.test_data['name'], self.sim_usage['wall_time'])
+            self._cache_outputs()
+        else:
+            print "Simulation %s left the queue without finishing." % \
+                self.test_data['name']
+
+    def _cache_outputs(self):
+        if self.cache is None: return
+        inputs = set(os.listdir(self.test_data['fulldir']))
+        inputs.update([self.local_exe, version_filename,
+                       machines[self.machine]['script']])
+        self.cache.store(self.cache_key, self.run_dir, inputs)
+
+    def usage(self):
+        """Returns the resource usage written by the last simulation in
+        this run directory."""
+        usage = {}
+        fn = os.path.join(self.run_dir, usage_filename)
+        if not os.path.exists(fn): return usage
+        for line in open(fn):
+            key, val = line.split("=")
+            usage[key.strip()] = float(val)
+        return usage
+
+    def run_sim(self):
+        if not self.start_sim(): return
+        supervisor = SimulationSupervisor()
+        try:
+            supervisor.add(self)
+            while supervisor.running:
+                supervisor.wait()
+        finally:
+            supervisor.close()
+
+    def run_test(self, compare_dir):
+        pool = AnswerTestPool(1)
+        try:
+            pool.submit(self, compare_dir)
+            pool.collect()
+        finally:
+            pool.close()
 
     def save_results(self):
         f = open(os.path.join(self.run_dir, results_filename), 'w')
@@ -430,12 +1834,577 @@ class EnzoTestRun(object):
             f.write("All tests failed because simulation did not finish.\n")
         f.close()
 
+def _list_dumps(run_dir):
+    """Returns the directories of the output dumps in run_dir, oldest first.
+    A dump is any directory holding a hierarchy file, whatever its
+    DataDumpDir and DataDumpName (DD0001/data0001 by default, DD0001/DD0001,
+    RD0001/RedshiftOutput0001 and so on)."""
+    dumps = {}
+    for hierarchy in glob.glob(os.path.join(run_dir, "*", "*.hierarchy")):
+        name = os.path.basename(os.path.dirname(hierarchy))
+        mtime = os.stat(hierarchy).st_mtime
+        dumps[name] = max(mtime, dumps.get(name, mtime))
+    return [name for mtime, name in
+            sorted([(mtime, name) for name, mtime in dumps.items()])]
+
+def _dump_divergence(dump_dir, baseline_dir):
+    """Returns (difference, field) for the dataset in dump_dir that differs
+    most from baseline_dir, measured as the largest absolute difference over
+    the largest baseline magnitude.  A dataset missing from either side
+    counts as a difference of infinity.  None if h5py is not available."""
+    try:
+        import h5py
+        import numpy
+    except ImportError:
+        return None
+    worst = (0.0, None)
+    for fn in sorted(os.listdir(baseline_dir)):
+        path = os.path.join(baseline_dir, fn)
+        if not h5py.is_hdf5(path): continue
+        if not os.path.exists(os.path.join(dump_dir, fn)):
+            return (float('inf'), fn)
+        baseline = h5py.File(path, 'r')
+        current = h5py.File(os.path.join(dump_dir, fn), 'r')
+        names = []
+        def add_dataset(name, obj):
+            if isinstance(obj, h5py.Dataset): names.append(name)
+        baseline.visititems(add_dataset)
+        try:
+            for name in names:
+                if name not in current:
+                    return (float('inf'), name)
+                a = current[name][...]
+                b = baseline[name][...]
+                if a.shape != b.shape:
+                    return (float('inf'), name)
+                if not a.size or a.dtype.kind not in 'iuf': continue
+                a = a.astype('float64')
+                b = b.astype('float64')
+                scale = numpy.abs(b).max()
+                difference = numpy.abs(a - b).max()
+                if scale > 0: difference /= scale
+                if not difference <= worst[0]:
+                    worst = (difference, name.split("/")[-1])
+        finally:
+            current.close()
+            baseline.close()
+    return worst
+
+def _init_test_worker():
+    # Undo the simulation supervisor's signal handling inherited at fork,
+    # and leave Ctrl-C to the runner.
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    try:
+        signal.set_wakeup_fd(-1)
+    except ValueError:
+        pass
+
+def _answer_test(run_dir, test_data, compare_dir):
+    """Runs the answer tests for the simulation in run_dir and returns
+    (run_finished, results, values), with results None if yt cannot run
+    answer tests and values the JSON-encoded result of each test that
+    produced one.  This changes directory, loads the test script
+    as a module and uses yt's global test registry, so it is meant to be
+    run in a process of its own by AnswerTestPool."""
+    if compare_dir is None:
+        compare_id = None
+    else:
+        compare_id = ""
+    os.chdir(run_dir)
+    run_finished = os.path.exists("RunFinished")
+    results = {}
+    values = {}
+
+    if os.path.exists(results_filename):
+        if run_finished:
+            print "Reading test results from file."
+            res_lines = file(results_filename)
+            for line in res_lines:
+                if len(line.split()) == 2:
+                    this_test, this_result = line.split()
+                    results[this_test] = bool(this_result)
+        return run_finished, results, values
+
+    fn = test_data['answer_testing_script']
+    if not _load_answer_testing():
+        print "This installation of yt does not support testing, please update to the branch 'yt'."
+        return run_finished, None, values
+    clear_registry()
+
+    handler = logging.FileHandler("testing.log")
+    f = logging.Formatter(ufstring)
+    handler.setFormatter(f)
+    mylog.addHandler(handler)
+    if run_finished:
+        if fn != 'None' and fn is not None:
+            if fn.endswith(".py"): fn = fn[:-3]
+            print "Loading module %s" % (fn)
+            f, filename, desc = imp.find_module(fn, ["."])
+            project = imp.load_module(fn, f, filename, desc)
+        if fn is None or fn == "None":
+            create_test(TestFieldStatistics, "field_stats", tolerance = 1e-10)
+            create_test(TestAllProjections, "all_projs", tolerance = 1e-10)
+        rtr = RegressionTestRunner("", compare_id,
+                    compare_results_path = compare_dir)
+        rtr.run_all_tests()
+        results = rtr.passed_tests.copy()
+        values = _result_values(rtr, results)
+    mylog.removeHandler(handler)
+    handler.close()
+    return run_finished, results, values
+
+def _result_values(rtr, results):
+    """Returns {test: JSON string} of the results yt stored for the tests
+    the runner rtr ran.  Arrays of more than value_max_size elements, like
+    projections, are kept as their shape, minimum, maximum and sum, so the
+    result store stays small."""
+    values = {}
+    stored = getattr(rtr, 'results', None)
+    if json is None or stored is None: return values
+    for test in results:
+        try:
+            value = stored[test]
+        except Exception:
+            continue
+        try:
+            values[test] = json.dumps(value, sort_keys=True,
+                                      default=_json_value)
+        except (TypeError, ValueError):
+            pass
+    return values
+
+def _json_value(value):
+    if hasattr(value, 'tolist') and hasattr(value, 'shape'):
+        if getattr(value, 'size', 0) > value_max_size:
+            return dict(shape = list(value.shape), min = value.min().item(),
+                        max = value.max().item(), sum = value.sum().item())
+        return value.tolist()
+    if hasattr(value, 'item'): return value.item()
+    if isinstance(value, (set, tuple)): return list(value)
+    raise TypeError("%r is not JSON serializable" % (value,))
+
+class AnswerTestPool(object):
+    """Runs answer tests in worker processes.  Every test gets a fresh
+    process, so its working directory, test module and yt registry cannot
+    leak into the runner or other tests, and several can run at once."""
+
+    def __init__(self, workers = 1):
+        # Import yt once here, so the forked workers inherit it rather than
+        # each paying for the import.
+        _load_answer_testing()
+        self.pool = multiprocessing.Pool(workers, _init_test_worker,
+                                         maxtasksperchild = 1)
+        self.pending = []
+
+    def submit(self, my_test, compare_dir):
+        if compare_dir is not None:
+            compare_dir = os.path.join(os.getcwd(), compare_dir,
+                                       my_test.test_data['fulldir'])
+        print "Running test: %s" % my_test.test_data['fulldir']
+        my_test.emit('test_started')
+        result = self.pool.apply_async(_answer_test,
+            (my_test.run_dir, my_test.test_data, compare_dir),
+            callback = lambda outcome: self._report(my_test, outcome))
+        self.pending.append((my_test, result))
+
+    def collect(self):
+        """Waits for every submitted test and saves its results."""
+        for my_test, result in self.pending:
+            try:
+                outcome = result.get()
+            except Exception, e:
+                print "Test %s raised an exception: %s" % \
+                    (my_test.test_data['name'], e)
+                run_finished = os.path.exists(os.path.join(my_test.run_dir,
+                                                           'RunFinished'))
+                outcome = (run_finished, {}, {})
+                self._report(my_test, outcome)
+            my_test.run_finished, my_test.results, my_test.values = outcome
+            if my_test.results is None:
+                my_test.results = {}
+                my_test.tests_unavailable = True
+                continue
+            my_test.save_results()
+        self.pending = []
+
+    def _report(self, my_test, outcome):
+        run_finished, results, values = outcome
+        if results is None:
+            my_test.emit('test_finished', run_finished = run_finished,
+                         unavailable = True)
+            return
+        my_test.emit('test_finished', run_finished = run_finished,
+                     passed = len([r for r in results.values() if r]),
+                     failed = len([r for r in results.values() if not r]),
+                     results = results)
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+class BatchScheduler(object):
+    """Runs simulations through a batch queue as job arrays.  submit() sends
+    a list of tests with the same nprocs as one array; poll() asks about
+    every array in a single call and returns the tests whose tasks have
+    left the queue.  Subclasses provide _submit and _states."""
+    poll_interval = 30.0
+    # Tasks the scheduler has never reported are given this long to show up
+    # before they are considered lost.
+    appear_timeout = 600.0
+
+    def __init__(self, machine, work_dir, max_cores=1):
+        self.machine = machine
+        self.work_dir = os.path.abspath(work_dir)
+        self.max_cores = max_cores
+        self.jobs = {}
+        self.seen = set()
+        self.done = set()
+        if not os.path.exists(self.work_dir): os.makedirs(self.work_dir)
+
+    def submit(self, tests):
+        nprocs = tests[0].test_data['nprocs']
+        run_list = os.path.join(self.work_dir, "run_list_%d" % nprocs)
+        f = open(run_list, 'w')
+        for my_test in tests:
+            # A task the queue kills must not leave an older run's usage.
+            usage = os.path.join(my_test.run_dir, usage_filename)
+            if os.path.exists(usage): os.remove(usage)
+            f.write("%s %s %d\n" % (my_test.run_dir,
+                                    my_test.test_data['run_par_file'],
+                                    60 * my_test.test_data['max_time_minutes']))
+        f.close()
+        # Each task enforces its own test's time limit; the array only has
+        # to leave room for the longest one and its grace period.
+        walltime = int(60 * max([t.test_data['max_time_minutes']
+                                 for t in tests]) +
+                       SimulationSupervisor.kill_grace)
+        template_vars = {'N_PROCS': str(nprocs),
+                         'WALL_TIME': _to_walltime(walltime),
+                         'KILL_GRACE': str(int(SimulationSupervisor.kill_grace)),
+                         'TEST_NAME': "enzo_tests_%d" % nprocs,
+                         'EXECUTABLE': "./%s" % tests[0].local_exe,
+                         'ARRAY_MAX': str(len(tests) - 1),
+                         'RUN_LIST': run_list}
+        template_vars.update(getattr(machine_config, self.machine, {}))
+        f = open(os.path.join(os.path.dirname(__file__), run_template_dir,
+                              machines[self.machine]['array_script']))
+        template = f.read()
+        f.close()
+        for var, value in template_vars.items():
+            template = template.replace('${%s}' % var, value)
+        script = os.path.join(self.work_dir, "array_%d.run" % nprocs)
+        f = open(script, 'w')
+        f.write(template)
+        f.close()
+        job_id = self._submit(script, len(tests), walltime)
+        self.jobs[job_id] = (time.time(), tests)
+        return job_id
+
+    def active(self):
+        return len(self.done) < sum([len(t) for s, t in self.jobs.values()])
+
+    def poll(self):
+        states = self._states()
+        # Without an answer from the scheduler nothing is known about any
+        # task, so none of them can be taken as done.
+        if states is None: return []
+        finished = []
+        now = time.time()
+        for job_id, (submitted, tests) in self.jobs.items():
+            for i, my_test in enumerate(tests):
+                task = (job_id, i)
+                if task in self.done: continue
+                state = states.get(task)
+                if state is not None and state != 'C':
+                    self.seen.add(task)
+                    continue
+                if task in self.seen or state == 'C' or \
+                        now - submitted > self.appear_timeout:
+                    self.done.add(task)
+                    finished.append(my_test)
+        return finished
+
+    def _submit(self, script, count, walltime):
+        """Submits script as an array of count tasks, each allowed walltime
+        seconds; returns the job id."""
+        raise NotImplementedError
+
+    def _states(self):
+        """Returns {(job_id, task index): state} for every task still known
+        to the scheduler, with PBS state letters (Q, R, C, ...), or None if
+        the scheduler could not be asked."""
+        raise NotImplementedError
+
+class PBSScheduler(BatchScheduler):
+    """Torque/PBS job arrays through qsub and qstat -t."""
+    _task_re = re.compile(r"^(\d+)\[(\d+)\]")
+
+    def _submit(self, script, count, walltime):
+        proc = subprocess.Popen(["qsub", script], cwd=self.work_dir,
+                                stdout=subprocess.PIPE)
+        output = proc.communicate()[0]
+        if proc.returncode != 0:
+            raise RuntimeError("qsub %s failed." % script)
+        # qsub prints e.g. "1234[].server"; qstat -t lists "1234[0].server".
+        return re.match(r"^(\d+)", output.strip()).group(1)
+
+    def _states(self):
+        try:
+            proc = subprocess.Popen(["qstat", "-t"], stdout=subprocess.PIPE)
+        except OSError:
+            print "qstat failed, will retry."
+            return None
+        output = proc.communicate()[0]
+        states = {}
+        if proc.returncode != 0:
+            print "qstat failed, will retry."
+            return None
+        for line in output.splitlines():
+            fields = line.split()
+            m = self._task_re.match(line)
+            if m is None or len(fields) < 5: continue
+            states[(m.group(1), int(m.group(2)))] = fields[4]
+        return states
+
+class FakeScheduler(BatchScheduler):
+    """Runs job arrays as local processes, at most max_cores cores' worth at
+    a time and killed at their wall time, to try out batch runs without a
+    queue."""
+    poll_interval = 1.0
+
+    def __init__(self, machine, work_dir, max_cores=1):
+        BatchScheduler.__init__(self, machine, work_dir, max_cores)
+        self.queued = []
+        self.running = {}
+        self.next_id = 1
+
+    def _submit(self, script, count, walltime):
+        job_id = str(self.next_id)
+        self.next_id += 1
+        nprocs = int(os.path.basename(script).split("_")[1].split(".")[0])
+        for i in range(count):
+            self.queued.append((job_id, i, script, nprocs, walltime))
+        return job_id
+
+    def _states(self):
+        now = time.time()
+        for task, (proc, nprocs, deadline) in self.running.items():
+            if proc.poll() is not None:
+                del self.running[task]
+            elif now > deadline:
+                os.killpg(proc.pid, signal.SIGKILL)
+        used = sum([nprocs for proc, nprocs, deadline in self.running.values()])
+        for item in self.queued[:]:
+            job_id, i, script, nprocs, walltime = item
+            if used + nprocs > self.max_cores and used > 0: continue
+            env = os.environ.copy()
+            env['PBS_ARRAYID'] = str(i)
+            proc = subprocess.Popen(["bash", script], cwd=self.work_dir,
+                                    env=env, close_fds=True,
+                                    preexec_fn=os.setsid)
+            self.running[(job_id, i)] = (proc, nprocs, now + walltime)
+            self.queued.remove(item)
+            used += nprocs
+        states = dict([((job_id, i), 'Q')
+                       for job_id, i, s, n, w in self.queued])
+        states.update(dict([(task, 'R') for task in self.running]))
+        return states
+
+batch_schedulers = {'pbs': PBSScheduler,
+                    'fake': FakeScheduler}
+
+class SimulationSupervisor(object):
+    """Watches a set of running simulations.  Instead of polling on a fixed
+    clock, it sleeps until SIGCHLD arrives or the nearest deadline is due,
+    so exits are noticed at once and time limits follow the wall clock."""
+    # How often to sample the memory of each simulation's process group.
+    sample_interval = 5.0
+    # How long after SIGUSR1 a simulation gets before it is SIGKILLed.
+    kill_grace = 60.0
+    # How long each wakeup may spend comparing dumps for --abort-divergence
+    # before getting back to exits and deadlines.  A dump already being
+    # compared is finished first.
+    divergence_budget = 1.0
+
+    def __init__(self):
+        self.running = {}
+        self._rfd, self._wfd = os.pipe()
+        for fd in (self._rfd, self._wfd):
+            flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+            fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        self._signals = False
+        try:
+            self._old_handler = signal.signal(signal.SIGCHLD, _ignore_signal)
+            self._signals = True
+            self._old_wakeup_fd = signal.set_wakeup_fd(self._wfd)
+        except ValueError:
+            # Signals can only be handled in the main thread; elsewhere,
+            # poll for exits once a second.
+            if self._signals:
+                signal.signal(signal.SIGCHLD, self._old_handler)
+                self._signals = False
+            self.sample_interval = min(self.sample_interval, 1.0)
+
+    def close(self):
+        if self._signals:
+            signal.set_wakeup_fd(self._old_wakeup_fd)
+            signal.signal(signal.SIGCHLD, self._old_handler)
+        os.close(self._rfd)
+        os.close(self._wfd)
+
+    def add(self, my_test):
+        self.running[my_test.proc.pid] = my_test
+
+    def wait(self):
+        """Blocks until at least one simulation has exited and returns the
+        list of finished tests."""
+        while self.running:
+            finished = self._reap()
+            if finished: return finished
+            now = time.time()
+            timeout = self.sample_interval
+            for my_test in self.running.values():
+                timeout = min(timeout, my_test.sim_deadline - now)
+            try:
+                select.select([self._rfd], [], [], max(timeout, 0))
+            except select.error, e:
+                if e.args[0] != errno.EINTR: raise
+            try:
+                while os.read(self._rfd, 512): pass
+            except OSError, e:
+                if e.errno != errno.EAGAIN: raise
+            self._enforce_deadlines()
+            self._sample_memory()
+            self._check_divergence()
+        return []
+
+    def _reap(self):
+        finished = []
+        for pid, my_test in self.running.items():
+            try:
+                wpid, status, rusage = os.wait4(pid, os.WNOHANG)
+            except OSError, e:
+                if e.errno != errno.EINTR: raise
+                continue
+            if wpid == 0: continue
+            del self.running[pid]
+            if os.WIFSIGNALED(status):
+                my_test.proc.returncode = -os.WTERMSIG(status)
+            else:
+                my_test.proc.returncode = os.WEXITSTATUS(status)
+            my_test._finish_sim(my_test.proc.returncode, rusage)
+            finished.append(my_test)
+        return finished
+
+    def _enforce_deadlines(self):
+        now = time.time()
+        for pid, my_test in self.running.items():
+            if now < my_test.sim_deadline: continue
+            if my_test.sim_signalled:
+                print "Simulation %s ignored SIGUSR1, killing it." % \
+                    my_test.test_data['name']
+                sig = signal.SIGKILL
+            else:
+                print "Simulation %s exceeded maximum run time." % \
+                    my_test.test_data['name']
+                sig = signal.SIGUSR1
+            my_test.sim_signalled = True
+            my_test.sim_deadline = now + self.kill_grace
+            my_test.emit('sim_timeout', signal = sig)
+            try:
+                os.killpg(pid, sig)
+            except OSError, e:
+                if e.errno != errno.ESRCH: raise
+
+    def _check_divergence(self):
+        # The simulations checked longest ago go first, so that none waits
+        # on the others' dumps for long.
+        stop = time.time() + self.divergence_budget
+        for pid, my_test in sorted(self.running.items(),
+                                   key=lambda item: item[1].divergence_checked):
+            if time.time() >= stop: break
+            if my_test.sim_signalled: continue
+            reason = my_test.check_divergence(stop)
+            if reason is None: continue
+            print "Simulation %s diverged (%s), killing it." % \
+                (my_test.test_data['name'], reason)
+            my_test.sim_signalled = True
+            my_test.sim_deadline = time.time() + self.kill_grace
+            my_test.emit('sim_diverged', reason = reason)
+            try:
+                os.killpg(pid, signal.SIGKILL)
+            except OSError, e:
+                if e.errno != errno.ESRCH: raise
+
+    def _sample_memory(self):
+        usage = _process_group_rss(self.running.keys())
+        for pid, rss in usage.items():
+            my_test = self.running[pid]
+            if rss > my_test.peak_rss:
+                my_test.emit('sim_memory', rss_kb = rss)
+            my_test.peak_rss = max(my_test.peak_rss, rss)
+
+def _ignore_signal(signum, frame):
+    pass
+
+def _process_group_rss(pgids):
+    """Returns the summed resident set size in kB of every process in each
+    of the given process groups.  Empty if /proc is not available."""
+    usage = {}
+    if not pgids or not os.path.isdir("/proc"): return usage
+    wanted = set(pgids)
+    page_kb = os.sysconf("SC_PAGE_SIZE") / 1024
+    for pid in os.listdir("/proc"):
+        if not pid.isdigit(): continue
+        try:
+            f = open("/proc/%s/stat" % pid)
+            stat = f.read()
+            f.close()
+        except IOError:
+            continue
+        # Fields after the command name: state ppid pgrp ... rss is the 24th.
+        fields = stat[stat.rfind(")") + 2:].split()
+        pgrp = int(fields[2])
+        if pgrp in wanted:
+            usage[pgrp] = usage.get(pgrp, 0) + int(fields[21]) * page_kb
+    return usage
+
 class UnspecifiedParameter(object):
     pass
 unknown = UnspecifiedParameter()
 
 if __name__ == "__main__":
     parser = optparse.OptionParser()
+    parser.add_option("--abort-divergence", dest='abort_divergence',
+                      type=float, default=None,
+                      help="Kill a simulation once a field in one of its "
+                      "outputs differs from --compare-dir by more than this "
+                      "fraction.")
+    parser.add_option("--benchmark", dest='benchmark', type=int, default=None,
+                      help="Run each simulation this many times and record "
+                           "its timings instead of answer testing.")
+    parser.add_option("--benchmark-baseline", dest='benchmark_baseline',
+                      default=None,
+                      help="Output directory of a baseline revision's "
+                           "benchmark to compare against.")
+    parser.add_option("--benchmark-threshold", dest='benchmark_threshold',
+                      type=float, default=0.05,
+                      help="Fractional slowdown worth reporting (default "
+                           "0.05).")
+    parser.add_option("--bisect", dest='bisect', default=None,
+                      help="Find the first revision in GOOD..BAD at which "
+                      "the selected test fails against -c, or slows down "
+                      "with --benchmark.")
+    parser.add_option("--budget", dest='budget', default=None,
+                      help="Run the most valuable tests that fit in this "
+                           "much time, e.g. 30m or 2h.")
+    parser.add_option("--build-dir", dest='build_dir', default=None,
+                      help="Where --bisect keeps its builds (default: builds "
+                      "in the output directory).")
+    parser.add_option("--cache-dir", dest='cache_dir', default=None,
+                      help="Reuse simulation outputs from identical earlier "
+                           "runs stored here.")
     parser.add_option("-c", "--compare-dir", dest='compare_dir',
                       default=None,
                       help="The directory structure to compare against")
@@ -444,14 +2413,70 @@ if __name__ == "__main__":
                       help="Recopies tests and tests from scratch.")
     parser.add_option("--interleave", action='store_true', dest='interleave', default=False,
                       help="Option to interleave preparation, running, and testing.")
+    parser.add_option("--events", dest='events', default=None,
+                      help="Append a JSON line for each step of the run "
+                      "(tests queued, started and finished, memory, "
+                      "results) to this file as it happens.")
+    parser.add_option("--history", dest='history', default=None,
+                      help="Runtime history file (default: %s in the "
+                           "output directory)." % history_filename)
     parser.add_option("-m", "--machine", dest='machine', default='local', 
                       help="Machine to run tests on.")
+    parser.add_option("--list", dest='list_only', action="store_true",
+                      default=False,
+                      help="Print the selected tests and exit.")
+    parser.add_option("--manifest", dest='manifest', default=manifest_filename,
+                      help="Cached index of the .enzotest files.")
+    parser.add_option("--max-cores", dest='max_cores', type=int, default=1,
+                      help="Number of cores to pack simulations onto, by nprocs.")
+    parser.add_option("--pipeline", action='store_true', dest='pipeline',
+                      default=False,
+                      help="Test each simulation as soon as it finishes.")
     parser.add_option("-o", "--output-dir", dest='output_dir',
                       help="Where to place the run directory")
+    parser.add_option("-q", "--query", dest='query', default=None,
+                      help="Select tests with an expression, e.g. "
+                           "\"nprocs <= 4 and (hydro or mhd)\".")
+    parser.add_option("--quota", dest='quota', default=None,
+                      help="Disk space the suite's outputs may use, e.g. "
+                      "200G; dumps of passing tests are deleted to fit.")
     parser.add_option("--repo", dest='repository', default="../",
                       help="Path to repository being tested.")
+    parser.add_option("--report", dest='report', type=int, default=None,
+                      help="Print the outcome of every test over this many "
+                           "recent revisions and exit.")
+    parser.add_option("--results-db", dest='results_db', default=None,
+                      help="Result database (default: %s in the output "
+                           "directory)." % results_db_filename)
+    parser.add_option("--shard", dest='shard', default=None,
+                      help="Run only shard i of N of the selected tests, "
+                      "given as i/N.")
+    parser.add_option("--shard-history", dest='shard_history', default=None,
+                      help="Copy of a runtime history to split the shards "
+                           "by (default: split by max_time_minutes).")
+    parser.add_option("--shard-run", dest='shard_run', default=None,
+                      help="Name of this run of the shards, the same on "
+                           "every node and new for each run; needed with "
+                           "--shard.")
+    parser.add_option("--retention", dest='retention', default='keep',
+                      type='choice', choices=retention_modes,
+                      help="What to do with the dumps of passing tests that "
+                      "answer testing does not use: %s (default keep)." %
+                      ", ".join(retention_modes))
     parser.add_option("--sim-only", dest='sim_only', action="store_true", 
                       default=False, help="Only run simulations.")
+    parser.add_option("--stage", dest='stage', default='copy',
+                      type='choice', choices=stage_modes,
+                      help="How to put test inputs and the executable in "
+                           "run directories: %s.  Copies are made "
+                           "read-only." % ", ".join(stage_modes))
+    parser.add_option("--test", dest='test_names', action='append',
+                      default=[],
+                      help="Select a test by name; may be repeated.")
+    parser.add_option("--test-workers", dest='test_workers', type=int,
+                      default=1,
+                      help="Number of answer tests to run at once, each in "
+                           "its own process.")
     parser.add_option("--test-only", dest='test_only', action="store_true", 
                       default=False, help="Only perform tests.")
     parser.add_option("-v", "--verbose", dest='verbose', action="store_true",
@@ -461,13 +2486,9 @@ if __name__ == "__main__":
                           type=str, default = unknown)
     options, args = parser.parse_args()
 
-    etc = EnzoTestCollection(verbose=options.verbose)
+    etc = EnzoTestCollection(verbose=options.verbose,
+                             manifest=options.manifest)
 
-    # Break out if output directory not specified.
-    if options.output_dir is None:
-        print 'Please enter an output directory with -o option'
-        sys.exit(1)
-    
     construct_selection = {}
     for var, caster in known_variables.items():
         if getattr(options, var) != unknown:
@@ -480,33 +2501,162 @@ if __name__ == "__main__":
     for k, v in sorted(construct_selection.items()):
         print "     %s = %s" % (k, v)
     etc2 = etc.select(**construct_selection)
+    if options.test_names:
+        print "     name in (%s)" % ", ".join(options.test_names)
+        etc2 = etc2.query("name in (%s)" % ", ".join(
+                ['"%s"' % name for name in options.test_names]))
+    if options.query is not None:
+        print "     %s" % options.query
+        try:
+            etc2 = etc2.query(options.query)
+        except ValueError, e:
+            print e
+            sys.exit(1)
+
+    if options.output_dir is not None:
+        options.output_dir = os.path.expanduser(options.output_dir)
+        if options.history is None:
+            options.history = os.path.join(options.output_dir,
+                                           history_filename)
+    # Only --budget needs the history to select tests; anything else can be
+    # listed without it.
+    history = None
+    if options.budget is not None:
+        history = TestHistory(options.history)
+    if options.budget is not None:
+        try:
+            budget = _parse_duration(options.budget)
+        except ValueError:
+            print "Could not understand --budget=%s." % options.budget
+            sys.exit(1)
+        etc2 = etc2.select_budget(budget, options.max_cores, history)
+        print "     budget = %s" % _to_walltime(budget)
+    if options.shard is not None:
+        try:
+            index, count = [int(v) for v in options.shard.split("/")]
+            if not 1 <= index <= count: raise ValueError
+        except ValueError:
+            print "Could not understand --shard=%s." % options.shard
+            sys.exit(1)
+        if options.shard_run is None:
+            print "Please give --shard-run to tell the results of this run " \
+                "of the shards from those of earlier ones."
+            sys.exit(1)
+        # The shared history changes as shards finish tests, so the split
+        # only uses a snapshot of it that every node is given.
+        shard_history = None
+        if options.shard_history is not None:
+            shard_history = TestHistory(
+                os.path.expanduser(options.shard_history))
+        etc2 = etc2.select_shard(index, count, options.shard_run,
+                                 options.max_cores, shard_history)
+        print "     shard = %d of %d" % (index, count)
     print
     print "\n".join(list(etc2.unique('name')))
     print "Total: %s" % len(etc2.tests)
+    if options.list_only: sys.exit(0)
+
+    # Break out if output directory not specified.
+    if options.output_dir is None:
+        print 'Please enter an output directory with -o option'
+        sys.exit(1)
+    
+    if options.results_db is None:
+        options.results_db = os.path.join(options.output_dir,
+                                          results_db_filename)
+    if options.report is not None:
+        if not os.path.exists(options.results_db):
+            print "No result database at %s." % options.results_db
+            sys.exit(1)
+        ResultStore(options.results_db).report(options.report)
+        sys.exit(0)
+    if history is None: history = TestHistory(options.history)
+    untimed = len([t for t in etc2.tests if not history.has_timing(t)])
+    print "Predicted simulation time on %d cores: %s (%d tests without " \
+        "timing history use max_time_minutes)." % \
+        (options.max_cores,
+         _to_walltime(predict_makespan(etc2.tests, options.max_cores, history)),
+         untimed)
 
     # get current revision
     options.repository = os.path.expanduser(options.repository)
     if options.compare_dir is not None:
         options.compare_dir = os.path.expanduser(options.compare_dir)
+    if options.cache_dir is not None:
+        options.cache_dir = os.path.abspath(
+            os.path.expanduser(options.cache_dir))
+    if options.bisect is not None:
+        if ".." not in options.bisect or len(etc2.tests) == 0:
+            print "Please give --bisect=GOOD..BAD and a test to bisect."
+            sys.exit(1)
+        if options.benchmark is None and options.compare_dir is None:
+            print "Bisecting needs -c to compare answers against, or " \
+                "--benchmark to compare timings."
+            sys.exit(1)
+        good, bad = options.bisect.split("..")
+        bisect_dir = os.path.join(options.output_dir, "bisect")
+        if options.build_dir is None:
+            options.build_dir = os.path.join(options.output_dir, "builds")
+        bisector = EnzoBisect(etc2.tests, options.repository, bisect_dir,
+                              os.path.expanduser(options.build_dir),
+                              options.machine, options.compare_dir,
+                              options.max_cores, options.benchmark,
+                              options.benchmark_threshold)
+        sys.exit(int(bisector.run(good, bad) is None))
+
     hg_current = _get_hg_version(options.repository)
     rev_hash = hg_current.split()[0]
+    history.revision = rev_hash
     options.output_dir = os.path.join(options.output_dir, rev_hash)
     if not os.path.exists(options.output_dir): os.makedirs(options.output_dir)
     f = open(os.path.join(options.output_dir, version_filename), 'w')
     f.write(hg_current)
     f.close()
 
+    results_db = ResultStore(options.results_db, rev_hash, hg_current.strip())
+
     # the path to the executable we're testing
     exe_path = os.path.join(options.repository, "src/enzo/enzo.exe")
 
+    if options.benchmark is not None:
+        current = etc2.benchmark(options.output_dir, options.machine, exe_path,
+                                 options.benchmark, options.max_cores)
+        if options.benchmark_baseline is not None:
+            f = open(os.path.join(os.path.expanduser(options.benchmark_baseline),
+                                  benchmark_filename))
+            baseline = json.load(f)
+            f.close()
+            regressions = compare_benchmarks(current, baseline,
+                options.benchmark_threshold,
+                os.path.join(options.output_dir, "benchmark_regressions.txt"))
+            sys.exit(int(regressions > 0))
+        sys.exit(0)
+
+    events = None
+    if options.events is not None:
+        try:
+            events = EventStream(os.path.expanduser(options.events))
+        except RuntimeError, e:
+            print e
+            sys.exit(1)
+
+    quota = None
+    if options.quota is not None:
+        try:
+            quota = _parse_size(options.quota)
+        except ValueError:
+            print "Could not understand --quota=%s." % options.quota
+            sys.exit(1)
+
     # Make it happen
     etc2.go(options.output_dir, options.interleave, options.machine, exe_path,
             options.compare_dir, sim_only=options.sim_only, 
-            test_only=options.test_only)
-    try:
-        import json
-    except ImportError:
-        json = None
+            test_only=options.test_only, max_cores=options.max_cores,
+            pipeline=options.pipeline, history=history,
+            results_db=results_db, test_workers=options.test_workers,
+            retention=options.retention, quota=quota, events=events)
+    results_db.close()
+    if events is not None: events.close()
     if json is not None and options.compare_dir is not None:
         f = open("results.js", "w")
         results = []